@@ -2,11 +2,20 @@ import requests
 import logging
 import json
 import time
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from deadline import bounded_timeout, bounded_sleep
+from config import (REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT, CONTAINER_MAX_WAIT_SECONDS,
+                    CONTAINER_POLL_INTERVAL_SECONDS, STATUS_HEDGE_AFTER_SECONDS, THREADS_AUTO_PUBLISH_TEXT)
 
 # ログの設定
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# ヘッジリクエスト（応答の遅いGETの再送）用のスレッドプール
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='threads-hedge')
+
 class ThreadsClient:
     """
     Threads APIクライアントクラス
@@ -15,28 +24,77 @@ class ThreadsClient:
     機能を提供します。
     """
 
-    def __init__(self, auth_token, username):
+    # テキスト投稿の自動公開（auto_publish_text）が使えるか（使えないと分かった時点で全クライアントで無効にする）
+    _auto_publish_supported = True
+    _auto_publish_lock = threading.Lock()
+
+    def __init__(self, auth_token, username, stage_prefix=''):
         """
         ThreadsClientの初期化
         
         :param auth_token: API認証用のトークン
+        :param stage_prefix: 段階名の接頭辞（返信用のクライアントでは'reply_'）
         """
         self.auth_token = auth_token
         self.username = username
         self.base_url = 'https://graph.threads.net/v1.0'
+        # 接続を使い回すためのセッション
+        self.session = requests.Session()
+        # 段階ごとの所要時間とAPI呼び出し回数の集計先（run_ledger.StageMetrics、オプション）
+        self.metrics = None
+        self.stage_prefix = stage_prefix
         logger.info("ThreadsClient初期化完了")
 
-    def _request(self, method, endpoint, params=None, data=None):
+    def _stage(self, name):
+        """
+        集計先が設定されている場合に段階nameの所要時間を計測する
+        """
+        return self.metrics.stage(self.stage_prefix + name) if self.metrics else nullcontext()
+
+    def _send(self, method, url, params, data, headers, timeout):
+        """
+        HTTPリクエストを1回送信する
+        """
+        if self.metrics:
+            self.metrics.add_api_call()
+        response = self.session.request(method, url, params=params, json=data, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        return response
+
+    def _send_hedged(self, hedge_after, *args):
+        """
+        hedge_after秒以内に応答がなければ同じリクエストをもう1つ送り、先に成功した応答を返す
+        （冪等なGETリクエスト専用）
+        """
+        first = _hedge_executor.submit(self._send, *args)
+        done, _ = wait([first], timeout=hedge_after)
+        if done:
+            return first.result()
+        logger.info(f"{hedge_after}秒以内に応答がないため、ヘッジリクエストを送信します: {args[1]}")
+        pending = {first, _hedge_executor.submit(self._send, *args)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e
+        raise error
+
+    def _request(self, method, endpoint, params=None, data=None, deadline=None, hedge_after=None):
         """
         APIリクエストを送信する内部メソッド
         
         :param method: HTTPメソッド（GET, POST等）
-        :param endpoint: APIエンドポイント
+        :param endpoint: APIエンドポイント（https://で始まる場合は絶対URLとして扱う）
         :param params: GETパラメータ（オプション）
         :param data: POSTデータ（オプション）
+        :param deadline: 処理期限（オプション）。タイムアウトは残り時間で切り詰められる
+        :param hedge_after: GETで応答がこの秒数を超えた場合にヘッジリクエストを送る（オプション）
         :return: APIレスポンスのJSONデータ
         """
-        url = f"{self.base_url}/{endpoint}"
+        url = endpoint if endpoint.startswith('https://') else f"{self.base_url}/{endpoint}"
         headers = {
             'Authorization': f'Bearer {self.auth_token}',
             'Content-Type': 'application/json'
@@ -49,9 +107,16 @@ class ThreadsClient:
         if data:
             logger.debug(f"データ: {json.dumps(data, indent=2, ensure_ascii=False)}")
 
+        timeout = (
+            bounded_timeout(REQUEST_CONNECT_TIMEOUT, deadline, endpoint),
+            bounded_timeout(REQUEST_READ_TIMEOUT, deadline, endpoint)
+        )
+
         try:
-            response = requests.request(method, url, params=params, json=data, headers=headers)
-            response.raise_for_status()
+            if hedge_after and method == 'GET':
+                response = self._send_hedged(hedge_after, method, url, params, data, headers, timeout)
+            else:
+                response = self._send(method, url, params, data, headers, timeout)
             logger.info(f"リクエスト成功. ステータスコード: {response.status_code}")
             logger.debug(f"レスポンス: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
             return response.json()
@@ -61,7 +126,31 @@ class ThreadsClient:
                 logger.error(f"レスポンス内容: {e.response.text}")
             raise
 
-    def create_media_container(self, media_type, image_url=None, video_url=None, text=None, is_carousel_item=False):
+    def get_profile(self):
+        """
+        トークンに紐づくプロフィールを取得（トークンの有効性確認に使用）
+        
+        :return: ユーザーIDとユーザー名を含む辞書
+        """
+        logger.info(f"プロフィール取得: ユーザー={self.username}")
+        return self._request('GET', 'me', params={'fields': 'id,username'})
+
+    def refresh_access_token(self):
+        """
+        長期アクセストークンを更新
+        
+        更新後のトークンでこのクライアントの認証情報も置き換えます。
+        
+        :return: 新しいアクセストークンと有効期限（秒）を含む辞書
+        """
+        params = {'grant_type': 'th_refresh_token'}
+        logger.info(f"アクセストークン更新: ユーザー={self.username}")
+        response = self._request('GET', 'https://graph.threads.net/refresh_access_token', params=params)
+        self.auth_token = response['access_token']
+        logger.info(f"アクセストークン更新成功. 有効期限: {response.get('expires_in')}秒")
+        return response
+
+    def create_media_container(self, media_type, image_url=None, video_url=None, text=None, is_carousel_item=False, deadline=None):
         """
         メディアコンテナを作成
         
@@ -70,6 +159,7 @@ class ThreadsClient:
         :param video_url: 動画URL（動画の場合）
         :param text: 投稿テキスト
         :param is_carousel_item: カルーセルアイテムかどうか
+        :param deadline: 処理期限（オプション）
         :return: 作成されたメディアコンテナのID
         """
         params = {
@@ -84,16 +174,18 @@ class ThreadsClient:
             params['text'] = text
 
         logger.info(f"メディアコンテナ作成: タイプ={media_type}, カルーセルアイテム={is_carousel_item}")
-        response = self._request('POST', f'/me/threads', params=params)
+        with self._stage('container'):
+            response = self._request('POST', f'/me/threads', params=params, deadline=deadline)
         logger.info(f"メディアコンテナ作成成功. ID: {response['id']}")
         return response['id']
 
-    def create_carousel_container(self, children_ids, text=None):
+    def create_carousel_container(self, children_ids, text=None, deadline=None):
         """
         カルーセルコンテナを作成
         
         :param children_ids: 子アイテムのID一覧
         :param text: 投稿テキスト
+        :param deadline: 処理期限（オプション）
         :return: 作成されたカルーセルコンテナのID
         """
         params = {
@@ -104,44 +196,113 @@ class ThreadsClient:
             params['text'] = text
 
         logger.info(f"カルーセルコンテナ作成: 子アイテム数={len(children_ids)}")
-        response = self._request('POST', f'/me/threads', params=params)
+        with self._stage('container'):
+            response = self._request('POST', f'/me/threads', params=params, deadline=deadline)
         logger.info(f"カルーセルコンテナ作成成功. ID: {response['id']}")
         return response['id']
 
-    def publish_thread(self, container_id):
+    def publish_thread(self, container_id, deadline=None):
         """
         スレッドを公開
         
         :param container_id: 公開するコンテナのID
+        :param deadline: 処理期限（オプション）
         :return: 公開されたスレッドのID
         """
         params = {'creation_id': container_id}
         logger.info(f"スレッド公開: コンテナID={container_id}")
-        response = self._request('POST', f'/me/threads_publish', params=params)
+        with self._stage('publish'):
+            response = self._request('POST', f'/me/threads_publish', params=params, deadline=deadline)
         logger.info(f"スレッド公開成功. ID: {response['id']}")
         return response['id']
 
-    def post_single_image(self, image_url, text=None):
+    def get_container_status(self, container_id, deadline=None):
+        """
+        メディアコンテナの処理状況を取得
+        
+        :param container_id: コンテナのID
+        :param deadline: 処理期限（オプション）
+        :return: status（IN_PROGRESS, FINISHED, ERROR, EXPIRED, PUBLISHED）とerror_messageを含む辞書
+        """
+        params = {'fields': 'status,error_message'}
+        return self._request('GET', container_id, params=params, deadline=deadline, hedge_after=STATUS_HEDGE_AFTER_SECONDS)
+
+    def wait_for_container(self, container_id, deadline=None):
+        """
+        メディアコンテナの処理完了を待機
+        
+        固定時間待つ代わりに処理状況をポーリングし、完了した時点で戻ります。
+        最大待機時間は期限の残り時間で短縮されます。
+        
+        :param container_id: コンテナのID
+        :param deadline: 処理期限（オプション）
+        """
+        logger.info(f"サーバーの処理を待機中（最大{CONTAINER_MAX_WAIT_SECONDS}秒）: コンテナID={container_id}")
+        with self._stage('wait'):
+            self._poll_container(container_id, deadline)
+
+    def _poll_container(self, container_id, deadline=None):
+        """
+        コンテナの処理状況を完了するか最大待機時間を過ぎるまでポーリングする
+        """
+        wait_until = time.monotonic() + CONTAINER_MAX_WAIT_SECONDS
+        while True:
+            try:
+                status = self.get_container_status(container_id, deadline=deadline)
+                if status.get('status') in ('FINISHED', 'PUBLISHED'):
+                    logger.info(f"コンテナの処理が完了しました: コンテナID={container_id}")
+                    return
+                if status.get('status') in ('ERROR', 'EXPIRED'):
+                    raise RuntimeError(f"コンテナの処理に失敗しました: {status.get('status')} {status.get('error_message', '')}")
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"コンテナの状態確認に失敗しました。待機を続けます: {e}")
+            remaining = wait_until - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"コンテナの処理完了を確認できないまま待機時間を過ぎました: コンテナID={container_id}")
+                return
+            bounded_sleep(min(CONTAINER_POLL_INTERVAL_SECONDS, remaining), deadline, 'wait')
+
+    def get_thread_insights(self, thread_id, metrics):
+        """
+        投稿のインサイト（指標）を取得
+        
+        :param thread_id: 公開済みスレッドのID
+        :param metrics: 取得する指標名のリスト（views, likes等）
+        :return: {指標名: 値} の辞書
+        """
+        params = {'metric': ','.join(metrics)}
+        logger.info(f"インサイト取得: スレッドID={thread_id}")
+        response = self._request('GET', f'{thread_id}/insights', params=params)
+        insights = {}
+        for item in response.get('data', []):
+            if 'total_value' in item:
+                insights[item['name']] = item['total_value'].get('value')
+            elif item.get('values'):
+                insights[item['name']] = item['values'][0].get('value')
+        return insights
+
+    def post_single_image(self, image_url, text=None, deadline=None):
         """
         単一画像の投稿
         
         :param image_url: 画像URL
         :param text: 投稿テキスト
+        :param deadline: 処理期限（オプション）
         :return: 公開されたスレッドのID
         """
         logger.info(f"単一画像投稿開始: URL={image_url}")
-        container_id = self.create_media_container('IMAGE', image_url=image_url, text=text)
-        logger.info("サーバーの処理を待機中（30秒）")
-        time.sleep(30)  # サーバーの処理を待機
-        thread_id = self.publish_thread(container_id)
+        container_id = self.create_media_container('IMAGE', image_url=image_url, text=text, deadline=deadline)
+        self.wait_for_container(container_id, deadline=deadline)  # サーバーの処理を待機
+        thread_id = self.publish_thread(container_id, deadline=deadline)
         logger.info(f"単一画像投稿完了. スレッドID: {thread_id}")
         return thread_id
     
-    def post_text_only(self, text: str) -> str:
+    def post_text_only(self, text: str, deadline=None) -> str:
         """
         テキストのみの投稿を作成する
 
         :param text: 投稿するテキスト
+        :param deadline: 処理期限（オプション）
         :return: 公開されたスレッドのID
         """
         logger.info(f"テキストのみの投稿を開始: {text[:30]}...")
@@ -149,18 +310,86 @@ class ThreadsClient:
             'media_type': 'TEXT',
             'text': text
         }
-        response = self._request('POST', f'/me/threads', params=params)
-        thread_id = self.publish_thread(response['id'])
+        thread_id = self._create_and_publish_text(params, self.publish_thread, deadline)
+        logger.info(f"テキストのみの投稿が完了しました。スレッドID: {thread_id}")
+        return thread_id
 
-        logger.info(f"テキスト投稿のコンテナの作成が成功しました。ID: {response['id']}")
+    def post_text_reply(self, reply_to_id: str, text: str, deadline=None) -> str:
+        """
+        テキストのみの返信を投稿する
+
+        :param reply_to_id: 返信先の投稿ID
+        :param text: 返信テキスト
+        :param deadline: 処理期限（オプション）
+        :return: 公開された返信のID
+        """
+        logger.info(f"テキストのみの返信を開始: 返信先ID={reply_to_id}")
+        params = {
+            'media_type': 'TEXT',
+            'text': text,
+            'reply_to_id': reply_to_id
+        }
+        return self._create_and_publish_text(params, self.publish_reply, deadline)
+
+    def _create_and_publish_text(self, params, publish, deadline=None):
+        """
+        テキストのみのコンテナを作成して公開する
+
+        自動公開が使える場合は1回のリクエストで作成と公開を行います。
+        使えない場合は作成→公開の2段階で投稿します（テキストはサーバーの処理待ちが不要なため待機しない）。
+
+        :param params: コンテナ作成のパラメータ
+        :param publish: 2段階で投稿する場合の公開メソッド（publish_threadまたはpublish_reply）
+        :param deadline: 処理期限（オプション）
+        :return: 公開されたスレッド（返信）のID
+        """
+        auto_publish_failed = False
+        if THREADS_AUTO_PUBLISH_TEXT and ThreadsClient._auto_publish_supported:
+            try:
+                with self._stage('publish'):
+                    response = self._request('POST', '/me/threads', params=dict(params, auto_publish_text='true'), deadline=deadline)
+                logger.info(f"自動公開で投稿しました。ID: {response['id']}")
+                return response['id']
+            except requests.exceptions.HTTPError as e:
+                if not self._is_auto_publish_rejected(e):
+                    raise
+                logger.warning(f"自動公開が拒否されました。作成→公開の2段階で投稿します: {e}")
+                auto_publish_failed = True
+
+        with self._stage('container'):
+            response = self._request('POST', '/me/threads', params=params, deadline=deadline)
+        logger.info(f"テキストのコンテナの作成が成功しました。ID: {response['id']}")
+        thread_id = publish(response['id'], deadline=deadline)
+
+        if auto_publish_failed:
+            # 同じ内容が2段階では投稿できたので、拒否の原因は自動公開そのもの
+            with ThreadsClient._auto_publish_lock:
+                ThreadsClient._auto_publish_supported = False
+            logger.warning("自動公開は使えないため、以降のテキスト投稿は2段階で行います。")
         return thread_id
 
-    def post_carousel(self, image_urls, text=None):
+    @staticmethod
+    def _is_auto_publish_rejected(error):
+        """
+        自動公開のリクエストが400で拒否されたか（トークンエラーを除く）
+
+        サーバーエラーやタイムアウトの場合は投稿済みの可能性があるため、2段階での再投稿は行いません。
+        """
+        response = error.response
+        if response is None or response.status_code != 400:
+            return False
+        try:
+            return response.json().get('error', {}).get('code') != 190
+        except ValueError:
+            return True
+
+    def post_carousel(self, image_urls, text=None, deadline=None):
         """
         カルーセル投稿
         
         :param image_urls: 画像URLのリスト
         :param text: 投稿テキスト
+        :param deadline: 処理期限（オプション）
         :return: 公開されたカルーセルスレッドのID
         """
         if len(image_urls) < 2 or len(image_urls) > 10:
@@ -171,25 +400,26 @@ class ThreadsClient:
         children_ids = []
         for i, url in enumerate(image_urls):
             logger.info(f"カルーセルアイテム {i+1}/{len(image_urls)} 作成中")
-            child_id = self.create_media_container('IMAGE', image_url=url, is_carousel_item=True)
+            child_id = self.create_media_container('IMAGE', image_url=url, is_carousel_item=True, deadline=deadline)
             children_ids.append(child_id)
             logger.info("カルーセルアイテム間の短い待機（5秒）")
-            time.sleep(5)  # アイテム作成間の短い待機
+            with self._stage('wait'):
+                bounded_sleep(5, deadline, 'carousel')  # アイテム作成間の短い待機
 
-        carousel_id = self.create_carousel_container(children_ids, text)
-        logger.info("サーバーの処理を待機中（30秒）")
-        time.sleep(30)  # サーバーの処理を待機
-        thread_id = self.publish_thread(carousel_id)
+        carousel_id = self.create_carousel_container(children_ids, text, deadline=deadline)
+        self.wait_for_container(carousel_id, deadline=deadline)  # サーバーの処理を待機
+        thread_id = self.publish_thread(carousel_id, deadline=deadline)
         logger.info(f"カルーセル投稿完了. スレッドID: {thread_id}")
         return thread_id
 
-    def create_reply(self, reply_to_id: str, text: str, image_url: str = None) -> str:
+    def create_reply(self, reply_to_id: str, text: str, image_url: str = None, deadline=None) -> str:
         """
         返信コンテナを作成する
 
         :param reply_to_id: 返信先の投稿ID
         :param text: 返信テキスト
         :param image_url: 画像URL（オプション）
+        :param deadline: 処理期限（オプション）
         :return: 作成された返信コンテナのID
         """
         logger.info(f"返信コンテナの作成を開始: 返信先ID={reply_to_id}")
@@ -201,20 +431,23 @@ class ThreadsClient:
         if image_url:
             params['image_url'] = image_url
 
-        response = self._request('POST', f'/me/threads', params=params)
+        with self._stage('container'):
+            response = self._request('POST', f'/me/threads', params=params, deadline=deadline)
         logger.info(f"返信コンテナの作成が成功しました。ID: {response['id']}")
         return response['id']
 
-    def publish_reply(self, container_id: str) -> str:
+    def publish_reply(self, container_id: str, deadline=None) -> str:
         """
         返信を公開する
 
         :param container_id: 公開する返信コンテナのID
+        :param deadline: 処理期限（オプション）
         :return: 公開された返信のID
         """
         logger.info(f"返信の公開を開始: コンテナID={container_id}")
         params = {'creation_id': container_id}
-        response = self._request('POST', f'/me/threads_publish', params=params)
+        with self._stage('publish'):
+            response = self._request('POST', f'/me/threads_publish', params=params, deadline=deadline)
         logger.info(f"返信の公開が成功しました。ID: {response['id']}")
         return response['id']
 
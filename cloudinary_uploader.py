@@ -1,49 +1,167 @@
 import cloudinary
 import cloudinary.uploader
+import cloudinary.utils
+import json
 import logging
-from config import CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET, WATERMARK_USERNAME, WATERMARK_POSITION, WATERMARK_STYLE
+import os
+import threading
+import time
+from typing import Dict
+from deadline import bounded_timeout
+from media_backend import file_digest
+from config import CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET, WATERMARK_USERNAME, WATERMARK_POSITION, WATERMARK_STYLE, UPLOAD_TIMEOUT
+from config import WATERMARK_DERIVED_URLS, WATERMARK_SIGN_URLS, UPLOAD_CACHE_FILE, UPLOAD_CACHE_TTL_DAYS
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class CloudinaryUploader:
+    # 元画像のハッシュ → アップロード結果（全アカウントのインスタンスで共有し、ファイルにも保存する）
+    _source_cache: Dict[str, Dict] = {}
+    _source_locks: Dict[str, threading.Lock] = {}
+    _cache_lock = threading.Lock()
+    _cache_loaded = False
+    _configured = False
+
     def __init__(self):
-        # Cloudinaryの設定
-        cloudinary.config(
-            cloud_name=CLOUDINARY_CLOUD_NAME,
-            api_key=CLOUDINARY_API_KEY,
-            api_secret=CLOUDINARY_API_SECRET
-        )
+        # Cloudinaryの設定（アップロードキャッシュが起動時のアカウントを指すため、プロセスで1回だけ行う）
+        if not CloudinaryUploader._configured:
+            cloudinary.config(
+                cloud_name=CLOUDINARY_CLOUD_NAME,
+                api_key=CLOUDINARY_API_KEY,
+                api_secret=CLOUDINARY_API_SECRET
+            )
+            CloudinaryUploader._configured = True
+        if WATERMARK_DERIVED_URLS:
+            self._load_source_cache()
         logger.info("Cloudinary uploader initialized")
 
-    def upload(self, image_path, username):
+    @classmethod
+    def _load_source_cache(cls):
+        with cls._cache_lock:
+            if cls._cache_loaded:
+                return
+            cls._cache_loaded = True
+            if not os.path.exists(UPLOAD_CACHE_FILE):
+                return
+            try:
+                with open(UPLOAD_CACHE_FILE, 'r', encoding='utf-8') as f:
+                    cls._source_cache = json.load(f)
+                logger.info(f"アップロード済み画像のキャッシュを読み込みました: {len(cls._source_cache)}件")
+            except json.JSONDecodeError:
+                logger.error(f"アップロードキャッシュ '{UPLOAD_CACHE_FILE}' の解析に失敗しました。空のキャッシュで開始します。")
+
+    @classmethod
+    def _save_source_cache(cls):
+        tmp_file = f"{UPLOAD_CACHE_FILE}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(cls._source_cache, f, indent=2)
+        os.replace(tmp_file, UPLOAD_CACHE_FILE)
+
+    @staticmethod
+    def _watermark_transformation(username):
+        """ユーザー名を印字するテキストオーバーレイの変換設定"""
+        return [
+            {
+                'overlay': {
+                    'font_family': 'Arial',
+                    'font_size': WATERMARK_STYLE['font_size'],
+                    'font_color': WATERMARK_STYLE['font_color'],
+                    'text': username
+                },
+                # SDKはoverlay内のfont_colorをURLに含めないため、文字色はcolorで指定する
+                'color': WATERMARK_STYLE['font_color'],
+                'opacity': WATERMARK_STYLE['opacity'],
+                'gravity': 'center',
+                'x': int(WATERMARK_POSITION['x'] * 100),
+                'y': int(WATERMARK_POSITION['y'] * 100)
+            }
+        ]
+
+    def upload(self, image_path, username, deadline=None):
+        return self.upload_with_size(image_path, username, deadline)[0]
+
+    def upload_with_size(self, image_path, username, deadline=None):
+        """
+        画像をアップロードし、公開URLと実際に送信したバイト数を返す
+
+        アップロード済みの画像を再利用した場合、送信したバイト数は0になります。
+
+        :return: (公開URL, 送信したバイト数)
+        """
         try:
+            if WATERMARK_DERIVED_URLS:
+                return self._derived_url(image_path, username, deadline)
+
             options = {
-                'folder': 'threadsapp_uploads'
+                'folder': 'threadsapp_uploads',
+                # 期限がある場合は残り時間で切り詰める
+                'timeout': bounded_timeout(UPLOAD_TIMEOUT, deadline, 'upload')
             }
-            
+
             if WATERMARK_USERNAME:
-                options['transformation'] = [
-                    {
-                        'overlay': {
-                            'font_family': 'Arial',
-                            'font_size': WATERMARK_STYLE['font_size'],
-                            'font_color': WATERMARK_STYLE['font_color'],
-                            'text': username
-                        },
-                        'opacity': WATERMARK_STYLE['opacity'],
-                        'gravity': 'center',
-                        'x': int(WATERMARK_POSITION['x'] * 100),
-                        'y': int(WATERMARK_POSITION['y'] * 100)
-                    }
-                ]
+                options['transformation'] = self._watermark_transformation(username)
 
             response = cloudinary.uploader.upload(image_path, **options)
             logger.info(f"画像を正常にアップロードしました: {response['secure_url']}")
 
-            return response['secure_url']
+            return response['secure_url'], os.path.getsize(image_path)
 
         except Exception as e:
             logger.error(f"画像のアップロード中にエラーが発生しました: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def _upload_source(self, image_path, deadline=None):
+        """
+        元画像を変換なしでアップロードする（同じ内容の画像は全アカウントで1回だけ）
+
+        :return: (public_id, version, format, secure_urlを含む辞書, 送信したバイト数)
+        """
+        digest = file_digest(image_path)
+        with self._cache_lock:
+            lock = self._source_locks.setdefault(digest, threading.Lock())
+        # 同じ画像を複数のスレッドが同時にアップロードしないようにする
+        with lock:
+            cached = self._source_cache.get(digest)
+            if cached and time.time() - cached['uploaded_at'] < UPLOAD_CACHE_TTL_DAYS * 86400:
+                logger.info(f"アップロード済みの画像を再利用します: {cached['public_id']}")
+                return cached, 0
+
+            response = cloudinary.uploader.upload(
+                image_path,
+                folder='threadsapp_uploads',
+                public_id=digest[:32],
+                overwrite=False,
+                timeout=bounded_timeout(UPLOAD_TIMEOUT, deadline, 'upload')
+            )
+            source = {
+                'public_id': response['public_id'],
+                'version': response.get('version'),
+                'format': response.get('format'),
+                'secure_url': response['secure_url'],
+                'uploaded_at': time.time()
+            }
+            with self._cache_lock:
+                self._source_cache[digest] = source
+                self._save_source_cache()
+            logger.info(f"元画像をアップロードしました: {response['secure_url']}")
+            return source, os.path.getsize(image_path)
+
+    def _derived_url(self, image_path, username, deadline=None):
+        """
+        元画像を1回だけアップロードし、アカウントごとの透かし入りURLをローカルで組み立てる
+        """
+        source, bytes_sent = self._upload_source(image_path, deadline)
+        if not WATERMARK_USERNAME:
+            return source['secure_url'], bytes_sent
+        url, _ = cloudinary.utils.cloudinary_url(
+            source['public_id'],
+            version=source['version'],
+            format=source['format'],
+            secure=True,
+            sign_url=WATERMARK_SIGN_URLS,
+            transformation=self._watermark_transformation(username)
+        )
+        logger.info(f"透かし入りURLを生成しました: {url}")
+        return url, bytes_sent
@@ -32,4 +32,111 @@ WATERMARK_STYLE = {
     'opacity': 70
 }
 
-REPLIES_PARENT_FOLDER = 'user_replies'
\ No newline at end of file
+# 元画像を1回だけアップロードし、アカウントごとの透かし入りURLを配信時の変換で生成する
+# （Falseの場合はアカウントごとに透かしを焼き込んだ画像をアップロードする）
+WATERMARK_DERIVED_URLS = True
+
+# 透かし入りURLに署名を付ける（Cloudinaryで「Strict transformations」を有効にしている場合はTrue）
+WATERMARK_SIGN_URLS = False
+
+# アップロード済みの元画像のキャッシュ（画像の内容のハッシュ → Cloudinary上のpublic_id）
+UPLOAD_CACHE_FILE = 'upload_cache.json'
+
+# アップロード済みの元画像を再利用する期間（日）
+UPLOAD_CACHE_TTL_DAYS = 30
+
+REPLIES_PARENT_FOLDER = 'user_replies'
+
+# 投稿履歴設定
+POST_HISTORY_FILE = 'post_history.json'
+
+# 同じ投稿を再度選べるようになるまでの時間（時間）
+POST_COOLDOWN_HOURS = 72
+
+# 投稿選択時の重み（未投稿の投稿を優先する）
+POST_SELECTION_WEIGHTS = {
+    'unposted': 3.0,  # 一度も投稿していない投稿
+    'reposted': 1.0   # クールダウンが明けた直後の投稿済みの投稿（前回の投稿から時間が経つほど'unposted'に近づく）
+}
+
+# アクセストークン管理設定
+TOKEN_CACHE_FILE = 'token_cache.json'
+
+# 有効期限がこの日数以内になったら長期トークンを更新する
+TOKEN_REFRESH_MARGIN_DAYS = 7
+
+# トークン検証結果を再利用する時間（分）
+TOKEN_VALIDATION_TTL_MINUTES = 60
+
+# 各スケジュールの何分前にトークンを事前検証するか
+TOKEN_PRECHECK_MINUTES = 10
+
+# トークン検証の同時実行数
+TOKEN_CHECK_MAX_WORKERS = 8
+
+# インサイト（投稿指標）設定
+INSIGHTS_DB_FILE = 'insights.db'
+
+# 取得する指標
+INSIGHTS_METRICS = ['views', 'likes', 'replies', 'reposts', 'quotes', 'shares']
+
+# 公開からこの日数以内の投稿のみ同期する
+INSIGHTS_FRESHNESS_DAYS = 14
+
+# 同じ投稿を再取得するまでの最小間隔（分）
+INSIGHTS_MIN_REFRESH_MINUTES = 60
+
+# トークンごとの1秒あたりの最大リクエスト数
+INSIGHTS_REQUESTS_PER_SECOND = 2
+
+# インサイト取得の同時実行数
+INSIGHTS_MAX_WORKERS = 16
+
+# 投稿テキストの最大文字数（Threadsの上限）
+THREADS_TEXT_MAX_LENGTH = 500
+
+# テキストのみの投稿・返信を1回のリクエストで作成・公開する（auto_publish_text）
+# 拒否された場合は自動的に作成→公開の2段階に切り替える
+THREADS_AUTO_PUBLISH_TEXT = True
+
+# 投稿取り込み時の画像チェック設定
+INGEST_MAX_IMAGE_BYTES = 8 * 1024 * 1024  # 8MB
+INGEST_MIN_IMAGE_WIDTH = 320
+INGEST_MAX_ASPECT_RATIO = 10  # 長辺/短辺の最大比
+
+# 投稿取り込みの並列プロセス数（Noneの場合はCPU数）
+INGEST_MAX_WORKERS = None
+
+# 通信タイムアウト設定（秒）
+REQUEST_CONNECT_TIMEOUT = 5
+REQUEST_READ_TIMEOUT = 30
+UPLOAD_TIMEOUT = 120
+
+# 処理期限（秒）: 1アカウントの投稿（アップロード〜返信）とスロット全体
+POST_DEADLINE_SECONDS = 300
+SLOT_DEADLINE_SECONDS = 3600
+
+# 返信を開始するのに必要な残り時間（秒）。足りない場合は返信を取りやめる
+REPLY_MIN_REMAINING_SECONDS = 20
+
+# コンテナの処理完了待ち（秒）
+CONTAINER_MAX_WAIT_SECONDS = 30
+CONTAINER_POLL_INTERVAL_SECONDS = 2
+
+# 状態確認のGETがこの秒数以内に応答しない場合に同じリクエストをもう1つ送る（Noneで無効）
+STATUS_HEDGE_AFTER_SECONDS = None
+
+# 返信チェーンの画像を並列にアップロードする数
+REPLY_UPLOAD_MAX_WORKERS = 4
+
+# 実行台帳（実行結果と段階ごとの所要時間）
+RUN_LEDGER_DB_FILE = 'run_ledger.db'
+
+# 画像の公開先（'cloudinary' または 'local'）
+# localの場合はMEDIA_LOCAL_ROOTの画像を自前のHTTPサーバー（python media_backend.py serve等）で配信する
+MEDIA_BACKEND = os.getenv('MEDIA_BACKEND', 'cloudinary')
+
+# ローカル配信の設定（MEDIA_LOCAL_BASE_URLはThreadsのサーバーから到達できる公開URL）
+MEDIA_LOCAL_ROOT = 'media_static'
+MEDIA_LOCAL_BASE_URL = os.getenv('MEDIA_LOCAL_BASE_URL')
+MEDIA_LOCAL_PORT = 8080
@@ -0,0 +1,127 @@
+import os
+import sys
+import logging
+import importlib
+from typing import List, Dict, Set, Optional, Tuple
+import config
+
+# inotifyはLinuxでinotify_simpleがインストールされている場合のみ使用する
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 起動時に一度だけ使われるため、実行中に変更しても反映されない設定
+RESTART_REQUIRED_SETTINGS = frozenset({
+    'CLOUDINARY_CLOUD_NAME', 'CLOUDINARY_API_KEY', 'CLOUDINARY_API_SECRET',  # cloudinary.config()は初回のみ
+    'TOKEN_PRECHECK_MINUTES',  # 登録済みの事前検証ジョブの時刻
+    'IMAGE_PAIRS_FOLDER', 'REPLIES_PARENT_FOLDER',
+    'POST_HISTORY_FILE', 'TOKEN_CACHE_FILE', 'INSIGHTS_DB_FILE', 'INSIGHTS_METRICS', 'RUN_LEDGER_DB_FILE',
+    'UPLOAD_CACHE_FILE', 'MEDIA_LOCAL_PORT',
+})
+
+class ConfigWatcher:
+    """
+    設定ファイルの変更を検知するクラス
+
+    inotifyが利用できる場合はそのイベントで、利用できない場合は更新時刻のポーリングで変更を検知します。
+    エディタによる置き換え保存にも対応するため、ファイルではなく親ディレクトリを監視します。
+    """
+
+    def __init__(self, paths: List[str]):
+        """
+        ConfigWatcherクラスのコンストラクタ
+
+        :param paths: 監視するファイルのパス一覧
+        """
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.signatures: Dict[str, Optional[Tuple[float, int]]] = {path: self._signature(path) for path in self.paths}
+        self.inotify = None
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                watch_flags = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+                for directory in {os.path.dirname(path) for path in self.paths}:
+                    self.inotify.add_watch(directory, watch_flags)
+                logger.info("inotifyで設定ファイルを監視します。")
+            except OSError as e:
+                logger.warning(f"inotifyを初期化できませんでした。更新時刻のポーリングで監視します: {e}")
+                self.inotify = None
+        else:
+            logger.info("更新時刻のポーリングで設定ファイルを監視します。")
+
+    @staticmethod
+    def _signature(path: str) -> Optional[Tuple[float, int]]:
+        """
+        ファイルの更新時刻とサイズを返す（存在しない場合はNone）
+        """
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def poll(self) -> Set[str]:
+        """
+        前回の呼び出し以降に変更されたファイルを返す（ブロックしない）
+
+        :return: 変更されたファイルの絶対パスの集合
+        """
+        if self.inotify is not None:
+            # イベントがなければstatも行わない
+            if not self.inotify.read(timeout=0):
+                return set()
+        changed = set()
+        for path in self.paths:
+            signature = self._signature(path)
+            if signature is not None and signature != self.signatures[path]:
+                changed.add(path)
+            self.signatures[path] = signature
+        return changed
+
+
+def reload_settings() -> List[str]:
+    """
+    config.pyを再読み込みし、`from config import ...` で取り込まれた値を各モジュールに反映する
+
+    反映されるのは関数内で参照される値と、以降に生成されるインスタンスです。
+    既に生成済みのインスタンスが保持している値は変わらないため、呼び出し側で作り直す必要があります。
+    RESTART_REQUIRED_SETTINGSの設定は再起動するまで反映されません（警告を出します）。
+    config.pyの読み込みに失敗した場合（保存途中の不完全なファイルなど）は現在の値を維持します。
+
+    :return: 値が変わった設定名の一覧
+    """
+    old_values = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    old_namespace = dict(vars(config))
+    try:
+        importlib.reload(config)
+    except Exception as e:
+        # 途中まで実行された場合に備えて、読み込み前の状態に戻す
+        vars(config).clear()
+        vars(config).update(old_namespace)
+        logger.error(f"config.pyの再読み込みに失敗しました。現在の設定を維持します: {type(e).__name__}: {e}")
+        return []
+    new_values = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    changed = [name for name, value in new_values.items() if old_values.get(name) != value]
+    if not changed:
+        return []
+
+    project_dir = os.path.dirname(os.path.abspath(config.__file__))
+    for module in list(sys.modules.values()):
+        module_file = getattr(module, '__file__', None)
+        if module is config or not module_file or os.path.dirname(os.path.abspath(module_file)) != project_dir:
+            continue
+        for name in changed:
+            if hasattr(module, name) and getattr(module, name) is old_values.get(name):
+                setattr(module, name, new_values[name])
+    applied = [name for name in changed if name not in RESTART_REQUIRED_SETTINGS]
+    restart_required = [name for name in changed if name in RESTART_REQUIRED_SETTINGS]
+    if applied:
+        logger.info(f"config.pyの設定を再読み込みしました: {', '.join(applied)}")
+    if restart_required:
+        logger.warning(f"次の設定は再起動するまで反映されません: {', '.join(restart_required)}")
+    return changed
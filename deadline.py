@@ -0,0 +1,89 @@
+import time
+import logging
+from typing import Optional
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class DeadlineExceeded(TimeoutError):
+    """
+    処理の期限を過ぎた（または残り時間が足りない）ことを表す例外
+    """
+
+
+class Deadline:
+    """
+    投稿やスロット全体の処理期限
+
+    子の期限は親の期限を超えないため、スロット→投稿→各段階（アップロード、コンテナ作成、待機、公開、返信）へ
+    渡していくことで、下流の処理ほど残り時間に合わせてタイムアウトが短くなります。
+    """
+
+    def __init__(self, seconds: float, parent: Optional['Deadline'] = None):
+        """
+        Deadlineクラスのコンストラクタ
+
+        :param seconds: 現在からの制限時間（秒）
+        :param parent: 親の期限（指定した場合はその期限を超えない）
+        """
+        self.expires_at = time.monotonic() + seconds
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+
+    def child(self, seconds: float) -> 'Deadline':
+        """
+        この期限を超えない子の期限を作成する
+
+        :param seconds: 子の制限時間（秒）
+        """
+        return Deadline(seconds, parent=self)
+
+    def remaining(self) -> float:
+        """
+        残り時間（秒）を返す
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str, min_remaining: float = 0) -> None:
+        """
+        残り時間が足りなければDeadlineExceededを送出する
+
+        :param stage: 処理段階の名前（エラーメッセージ用）
+        :param min_remaining: この段階を開始するのに必要な残り時間（秒）
+        """
+        remaining = self.remaining()
+        if remaining <= min_remaining:
+            raise DeadlineExceeded(f"{stage}: 期限までの残り時間が不足しています（残り {remaining:.1f}秒）")
+
+    def timeout(self, default: float, stage: str = 'request') -> float:
+        """
+        既定のタイムアウトを残り時間で切り詰めた値を返す
+
+        :param default: 既定のタイムアウト（秒）
+        :param stage: 処理段階の名前（エラーメッセージ用）
+        """
+        self.check(stage)
+        return min(default, self.remaining())
+
+
+def bounded_timeout(default: float, deadline: Optional[Deadline], stage: str = 'request') -> float:
+    """
+    期限がある場合は残り時間で切り詰めたタイムアウトを、ない場合は既定値を返す
+    """
+    return deadline.timeout(default, stage) if deadline else default
+
+def bounded_sleep(seconds: float, deadline: Optional[Deadline], stage: str = 'wait') -> None:
+    """
+    期限を超えない範囲で待機する（期限が近い場合は待機時間を短縮する）
+    """
+    if deadline:
+        seconds = min(seconds, deadline.remaining())
+        if seconds < 0.001:
+            deadline.check(stage)
+            return
+        logger.debug(f"{stage}: {seconds:.1f}秒待機します（期限まで残り {deadline.remaining():.1f}秒）")
+    time.sleep(seconds)
@@ -1,18 +1,32 @@
 import os
 import json
 import logging
-from config import IMAGE_PAIRS_FOLDER, IMAGE_PAIRS_JSON
-import random
-from typing import List, Dict
+from config import IMAGE_PAIRS_FOLDER, IMAGE_PAIRS_JSON, POST_HISTORY_FILE, POST_COOLDOWN_HOURS, POST_SELECTION_WEIGHTS
+from typing import List, Dict, Optional
+from post_history import PostHistory, PostSelector
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class PostContentManager:
-    def __init__(self, content_folder: str):
+    def __init__(self, content_folder: str, history: Optional[PostHistory] = None):
         self.content_folder = content_folder
+        self.history = history or PostHistory(POST_HISTORY_FILE)
+        self.selector = self._build_selector()
 
+    def _build_selector(self) -> PostSelector:
+        return PostSelector(
+            self.history,
+            POST_COOLDOWN_HOURS,
+            POST_SELECTION_WEIGHTS['unposted'],
+            POST_SELECTION_WEIGHTS['reposted']
+        )
+
+    def reload_settings(self) -> None:
+        """現在のクールダウンと重みの設定で投稿の選択インデックスを作り直す"""
+        self.selector = self._build_selector()
+        logger.info("投稿選択の設定を反映しました。")
 
     def get_user_posts(self, username: str) -> List[Dict[str, str]]:
         user_folder = os.path.join(self.content_folder, username)
@@ -44,16 +58,30 @@ class PostContentManager:
 
         if not post:
             logger.warning(f"Invalid post folder structure: {post_path}")
+        else:
+            post["post_id"] = os.path.basename(post_path)
+            post["path"] = post_path
         
         return post
         
     def get_random_post(self, username: str) -> Dict[str, str]:
-        posts = self.get_user_posts(username)
-        if posts:
-            return random.choice(posts)
-        else:
-            logger.warning(f"No posts found for user: {username}")
-            return {}
+        """投稿履歴を考慮して次の投稿を選ぶ（最近投稿していない投稿を優先）"""
+        user_folder = os.path.join(self.content_folder, username)
+        while True:
+            post_id = self.selector.select(username, user_folder)
+            if post_id is None:
+                logger.warning(f"No posts found for user: {username}")
+                return {}
+            post = self._load_post(os.path.join(user_folder, post_id))
+            if post:
+                return post
+            # 無効な投稿フォルダは抽選対象から外して選び直す
+            self.selector.exclude(username, post_id)
+
+    def mark_posted(self, username: str, post: Dict[str, str]) -> None:
+        """投稿済みとして履歴に記録する"""
+        if post.get("post_id"):
+            self.selector.mark_posted(username, post["post_id"])
 
     def read_caption(self, folder_path):
         """フォルダ内のcaption.txtファイルからキャプションを読み取る"""
@@ -1,30 +1,38 @@
 import random
 import os
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 from base_post import ThreadsClient
-from cloudinary_uploader import CloudinaryUploader
+from media_backend import get_media_backend
 from image_pair_manager import PostContentManager
 from config import IMAGE_PAIRS_FOLDER
-from reply_poster import ReplyPoster
+from reply_poster import ReplyPoster, ReplyChain
 from config import REPLIES_PARENT_FOLDER
+from deadline import Deadline
+from run_ledger import StageMetrics
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class PostManager:
-    def __init__(self, auth_token: str, username: str, content_folder: str):
+    def __init__(self, auth_token: str, username: str, content_folder: str, content_manager: Optional[PostContentManager] = None):
         """
         ImagePairPosterクラスのコンストラクタ
 
         :param auth_token: Threads APIの認証トークン
+        :param content_manager: 共有するPostContentManager（投稿履歴と選択インデックスを再利用する）
         """
+        self.auth_token = auth_token
         self.threads_client = ThreadsClient(auth_token, username)
-        self.cloudinary_uploader = CloudinaryUploader()
-        self.content_manager = PostContentManager(content_folder)
+        self.media_backend = get_media_backend()
+        self.content_manager = content_manager or PostContentManager(content_folder)
         self.username = username
         self.reply_poster = ReplyPoster(auth_token, username, REPLIES_PARENT_FOLDER)
+        # 直近の投稿に対して準備した返信チェーン
+        self.reply_chain: Optional[ReplyChain] = None
+        # 直近の投稿の段階ごとの所要時間の集計先
+        self.metrics: Optional[StageMetrics] = None
 
         logger.info("PostManagerが初期化されました。")
 
@@ -39,37 +47,48 @@ class PostManager:
         #logger.info(f"ランダムに選択された画像ペア: {selected_pair['folder']}")
         #return selected_pair
 
-    def post_content(self) -> Dict[str, str]:
+    def post_content(self, deadline: Optional[Deadline] = None, metrics: Optional[StageMetrics] = None) -> Dict[str, str]:
         post = self.content_manager.get_random_post(self.username)
         if not post:
             raise ValueError(f"No posts available for user: {self.username}")
 
+        self.metrics = metrics
+        self.threads_client.metrics = metrics
+        # 本投稿の処理中に返信画像のアップロードを並列に進めておく
+        self.reply_chain = self.reply_poster.prepare_chain(post.get("path"), deadline, metrics)
+
         try:
             if "image1" in post and "image2" in post:
-                return self._post_image_pair(post)
+                thread_id = self._post_image_pair(post, deadline)
             elif "image1" in post:
-                return self._post_single_image(post)
+                thread_id = self._post_single_image(post, deadline)
             elif "caption" in post:
-                return self._post_text_only(post)
+                thread_id = self._post_text_only(post, deadline)
             else:
                 raise ValueError("Invalid post content")
+            self.content_manager.mark_posted(self.username, post)
+            return thread_id
         except Exception as e:
             logger.error(f"Error posting content: {str(e)}")
+            self.reply_chain.cancel()
             raise
 
-    def _post_image_pair(self, post: Dict[str, str]) -> Dict[str, str]:
-        image1_url = self.cloudinary_uploader.upload(post['image1'], self.username)
-        image2_url = self.cloudinary_uploader.upload(post['image2'], self.username)
-        thread_id = self.threads_client.post_carousel([image1_url, image2_url], post['caption'])
+    def _upload(self, image_path: str, deadline: Optional[Deadline] = None) -> str:
+        return self.media_backend.upload_measured(image_path, self.username, deadline, self.metrics, 'upload')
+
+    def _post_image_pair(self, post: Dict[str, str], deadline: Optional[Deadline] = None) -> Dict[str, str]:
+        image1_url = self._upload(post['image1'], deadline)
+        image2_url = self._upload(post['image2'], deadline)
+        thread_id = self.threads_client.post_carousel([image1_url, image2_url], post['caption'], deadline=deadline)
         return thread_id
     
-    def _post_single_image(self, post: Dict[str, str]) -> Dict[str, str]:
-        image_url = self.cloudinary_uploader.upload(post['image1'], self.username)
-        thread_id = self.threads_client.post_single_image(image_url, post.get('caption'))
+    def _post_single_image(self, post: Dict[str, str], deadline: Optional[Deadline] = None) -> Dict[str, str]:
+        image_url = self._upload(post['image1'], deadline)
+        thread_id = self.threads_client.post_single_image(image_url, post.get('caption'), deadline=deadline)
         return thread_id
     
-    def _post_text_only(self, post: Dict[str, str]) -> Dict[str, str]:
-        thread_id = self.threads_client.post_text_only(post['caption'])
+    def _post_text_only(self, post: Dict[str, str], deadline: Optional[Deadline] = None) -> Dict[str, str]:
+        thread_id = self.threads_client.post_text_only(post['caption'], deadline=deadline)
         return thread_id
 
     def post_content_with_reply(self) -> Dict[str, str]:
@@ -103,8 +122,8 @@ class PostManager:
                 raise ValueError(f"ユーザー '{self.username}' の投稿が見つかりません。")
 
             # 画像をアップロード
-            image1_url = self.cloudinary_uploader.upload(post['image1'], self.username)
-            image2_url = self.cloudinary_uploader.upload(post['image2'], self.username)
+            image1_url = self.media_backend.upload(post['image1'], self.username)
+            image2_url = self.media_backend.upload(post['image2'], self.username)
 
             # 画像ペアを投稿
             thread_id = self.threads_client.post_carousel([image1_url, image2_url], post['caption'])
@@ -0,0 +1,271 @@
+import os
+import re
+import shutil
+import struct
+import logging
+import zipfile
+import tarfile
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple
+from config import (IMAGE_PAIRS_FOLDER, THREADS_TEXT_MAX_LENGTH, INGEST_MAX_IMAGE_BYTES, INGEST_MIN_IMAGE_WIDTH,
+                    INGEST_MAX_ASPECT_RATIO, INGEST_MAX_WORKERS)
+from reply_patterns import REPLY_TEXT_PATTERN, REPLY_IMAGE_PATTERN
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+MAX_IMAGES_PER_POST = 2
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.zip', '.tar')
+
+# サイズ情報を持つJPEGのSOFマーカー（DHT, JPG, DACを除くC0-CF）
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def read_jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    JPEGデータから画像サイズを読み取る
+
+    :param data: 画像ファイルの内容
+    :return: (幅, 高さ)。JPEGでない、またはサイズが読み取れない場合はNone
+    """
+    if data[:3] != b'\xff\xd8\xff':
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker == 0xD9:
+            return None
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker in SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+def _natural_key(name: str) -> list:
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def _validate_caption(path: str) -> Tuple[Optional[str], List[str]]:
+    """
+    テキストファイルを読み込み、文字コードと文字数を検証する
+
+    :return: (テキスト, エラー一覧)
+    """
+    try:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            text = f.read().strip()
+    except UnicodeDecodeError:
+        return None, [f"キャプションがUTF-8ではありません: {os.path.basename(path)}"]
+    if len(text) > THREADS_TEXT_MAX_LENGTH:
+        return text, [f"キャプションが長すぎます: {len(text)}文字（上限 {THREADS_TEXT_MAX_LENGTH}文字）"]
+    return text or None, []
+
+def _validate_image(path: str, name: str) -> List[str]:
+    """
+    画像ファイルの形式、サイズ、縦横比を検証する
+
+    :return: エラー一覧
+    """
+    size = os.path.getsize(path)
+    if size > INGEST_MAX_IMAGE_BYTES:
+        return [f"{name}: ファイルサイズが大きすぎます: {size}バイト（上限 {INGEST_MAX_IMAGE_BYTES}バイト）"]
+    with open(path, 'rb') as f:
+        dimensions = read_jpeg_size(f.read())
+    if dimensions is None:
+        return [f"{name}: JPEG画像ではないか、画像サイズを読み取れません"]
+    errors = []
+    width, height = dimensions
+    if width < INGEST_MIN_IMAGE_WIDTH:
+        errors.append(f"{name}: 幅が小さすぎます: {width}px（下限 {INGEST_MIN_IMAGE_WIDTH}px）")
+    if max(width, height) > INGEST_MAX_ASPECT_RATIO * min(width, height):
+        errors.append(f"{name}: 縦横比が極端です: {width}x{height}")
+    return errors
+
+def validate_post(post_dir: str) -> Dict:
+    """
+    投稿フォルダのキャプションと画像を検証する（プロセスプールで実行される）
+
+    :param post_dir: 投稿フォルダのパス
+    :return: 検証結果（source, caption, images, reply_files, errors）
+    """
+    result = {"source": post_dir, "caption": None, "images": [], "reply_files": [], "errors": []}
+    files = sorted((f for f in os.listdir(post_dir) if os.path.isfile(os.path.join(post_dir, f)) and not f.startswith('.')),
+                   key=_natural_key)
+
+    # 返信チェーンのファイル（reply1.txt, reply1_image.jpg等）はそのままの名前で取り込む
+    for name in [f for f in files if REPLY_TEXT_PATTERN.match(f) or REPLY_IMAGE_PATTERN.match(f)]:
+        files.remove(name)
+        path = os.path.join(post_dir, name)
+        if REPLY_TEXT_PATTERN.match(name):
+            result["errors"].extend(f"{name}: {error}" for error in _validate_caption(path)[1])
+        else:
+            result["errors"].extend(_validate_image(path, name))
+        result["reply_files"].append(path)
+
+    # キャプション（caption.txt、なければ唯一の.txtファイル）
+    text_files = [f for f in files if f.lower().endswith('.txt')]
+    caption_file = 'caption.txt' if 'caption.txt' in text_files else (text_files[0] if len(text_files) == 1 else None)
+    if len(text_files) > 1 and caption_file is None:
+        result["errors"].append(f"キャプションファイルを特定できません: {text_files}")
+    if caption_file:
+        result["caption"], errors = _validate_caption(os.path.join(post_dir, caption_file))
+        result["errors"].extend(errors)
+
+    # 画像
+    image_files = [f for f in files if f.lower().endswith(IMAGE_EXTENSIONS)]
+    if len(image_files) > MAX_IMAGES_PER_POST:
+        result["errors"].append(f"画像が多すぎます: {len(image_files)}枚（上限 {MAX_IMAGES_PER_POST}枚）")
+    for image_file in image_files[:MAX_IMAGES_PER_POST]:
+        image_path = os.path.join(post_dir, image_file)
+        errors = _validate_image(image_path, image_file)
+        result["errors"].extend(errors)
+        if not errors:
+            result["images"].append(image_path)
+
+    if not result["caption"] and not image_files:
+        result["errors"].append("キャプションも画像もありません")
+    return result
+
+def normalize_post_name(name: str) -> str:
+    """
+    投稿フォルダ名をファイルシステムで安全な名前に正規化する
+    """
+    name = re.sub(r'[\\/:*?"<>|\s]+', '_', name.strip()).strip('._')
+    return name or 'post'
+
+def _source_name(source: str) -> str:
+    """
+    取り込み元のフォルダ名、またはアーカイブのファイル名（拡張子を除く）を返す
+    """
+    name = os.path.basename(os.path.normpath(source))
+    for extension in ARCHIVE_EXTENSIONS:
+        if name.lower().endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+def _find_post_dirs(root: str) -> List[str]:
+    """
+    取り込み元から投稿フォルダの一覧を取得する
+
+    ルートが単一のフォルダだけを含む場合（アーカイブの最上位フォルダなど）はその中を探す。
+    ルート直下にファイルがありサブフォルダがない場合はルート自体を1つの投稿とみなす。
+    """
+    entries = [e for e in os.listdir(root) if not e.startswith('.') and e != '__MACOSX']
+    dirs = sorted((e for e in entries if os.path.isdir(os.path.join(root, e))), key=_natural_key)
+    files = [e for e in entries if os.path.isfile(os.path.join(root, e))]
+    if len(dirs) == 1 and not files:
+        return _find_post_dirs(os.path.join(root, dirs[0]))
+    if not dirs and files:
+        return [root]
+    return [os.path.join(root, d) for d in dirs]
+
+def _write_post(validated: Dict, user_folder: str) -> Optional[str]:
+    """
+    検証済みの投稿を正規化したファイル名でコンテンツフォルダに書き込む
+
+    一時フォルダに書き込んでから名前を変更するため、投稿中のプロセスが書きかけの投稿を読むことはない。
+
+    :return: 書き込んだ投稿フォルダのパス。同名の投稿が既に存在する場合はNone
+    """
+    post_name = normalize_post_name(validated["post_name"])
+    dest = os.path.join(user_folder, post_name)
+    if os.path.exists(dest):
+        logger.warning(f"同名の投稿が既に存在するためスキップします: {dest}")
+        return None
+    tmp_dest = os.path.join(user_folder, f".ingest_{post_name}")
+    shutil.rmtree(tmp_dest, ignore_errors=True)
+    os.makedirs(tmp_dest)
+    if validated["caption"]:
+        with open(os.path.join(tmp_dest, 'caption.txt'), 'w', encoding='utf-8') as f:
+            f.write(validated["caption"])
+    for i, image_path in enumerate(validated["images"], start=1):
+        shutil.copyfile(image_path, os.path.join(tmp_dest, f'image{i}.jpg'))
+    for reply_path in validated["reply_files"]:
+        shutil.copyfile(reply_path, os.path.join(tmp_dest, os.path.basename(reply_path)))
+    os.rename(tmp_dest, dest)
+    return dest
+
+def ingest(source: str, username: str, content_folder: str = IMAGE_PAIRS_FOLDER, dry_run: bool = False) -> Dict[str, list]:
+    """
+    アーカイブまたはフォルダから投稿を検証して取り込む
+
+    :param source: 取り込み元（.zip / .tar / .tar.gz / .tgz またはフォルダ）
+    :param username: 取り込み先のユーザー名
+    :param content_folder: コンテンツフォルダ（user_post）
+    :param dry_run: Trueの場合は検証のみ行う
+    :return: 取り込み結果（ingested, skipped, invalid）
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if os.path.isdir(source):
+            root = source
+        elif zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as archive:
+                archive.extractall(tmp_dir)
+            root = tmp_dir
+        elif tarfile.is_tarfile(source):
+            with tarfile.open(source) as archive:
+                archive.extractall(tmp_dir, filter='data')
+            root = tmp_dir
+        else:
+            raise ValueError(f"取り込み元はフォルダ、zip、tarのいずれかである必要があります: {source}")
+
+        post_dirs = _find_post_dirs(root)
+        logger.info(f"{len(post_dirs)}件の投稿を検証します。")
+        with ProcessPoolExecutor(max_workers=INGEST_MAX_WORKERS) as executor:
+            results = list(executor.map(validate_post, post_dirs, chunksize=16))
+
+        summary = {"ingested": [], "skipped": [], "invalid": []}
+        user_folder = os.path.join(content_folder, username)
+        os.makedirs(user_folder, exist_ok=True)
+        for validated in results:
+            if os.path.normpath(validated["source"]) == os.path.normpath(root):
+                # ルート直下のファイルが1つの投稿の場合は、一時フォルダ名ではなく取り込み元の名前を使う
+                validated["name"] = validated["post_name"] = _source_name(source)
+            else:
+                # 一時フォルダのパスではなく取り込み元からの相対パスで表示する
+                validated["name"] = os.path.relpath(validated["source"], root)
+                validated["post_name"] = os.path.basename(os.path.normpath(validated["source"]))
+            if validated["errors"]:
+                logger.error(f"無効な投稿: {validated['name']}: {'; '.join(validated['errors'])}")
+                summary["invalid"].append(validated)
+                continue
+            if dry_run:
+                summary["ingested"].append(validated["name"])
+                continue
+            dest = _write_post(validated, user_folder)
+            summary["ingested" if dest else "skipped"].append(dest or validated["name"])
+
+    logger.info(f"取り込み完了: 取り込み {len(summary['ingested'])}件, スキップ {len(summary['skipped'])}件, 無効 {len(summary['invalid'])}件")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="投稿をまとめて検証し、コンテンツフォルダに取り込む")
+    parser.add_argument('source', help="取り込み元のアーカイブ（zip/tar）またはフォルダ")
+    parser.add_argument('username', help="取り込み先のユーザー名")
+    parser.add_argument('--content-folder', default=IMAGE_PAIRS_FOLDER, help="コンテンツフォルダ")
+    parser.add_argument('--dry-run', action='store_true', help="検証のみ行い、書き込まない")
+    args = parser.parse_args()
+
+    summary = ingest(args.source, args.username, args.content_folder, args.dry_run)
+    for validated in summary["invalid"]:
+        print(f"NG  {validated['name']}")
+        for error in validated["errors"]:
+            print(f"    - {error}")
+    print(f"取り込み: {len(summary['ingested'])}件, スキップ: {len(summary['skipped'])}件, 無効: {len(summary['invalid'])}件")
+    return 1 if summary["invalid"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
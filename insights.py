@@ -0,0 +1,254 @@
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional
+from base_post import ThreadsClient
+from user_manager import UserManager
+from config import (INSIGHTS_DB_FILE, INSIGHTS_METRICS, INSIGHTS_FRESHNESS_DAYS, INSIGHTS_MIN_REFRESH_MINUTES,
+                    INSIGHTS_REQUESTS_PER_SECOND, INSIGHTS_MAX_WORKERS, REPLIES_PARENT_FOLDER)
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class InsightsStore:
+    """
+    公開済みスレッドとそのインサイトを保存するSQLiteストア
+    """
+
+    def __init__(self, db_file: str = INSIGHTS_DB_FILE):
+        """
+        InsightsStoreクラスのコンストラクタ
+
+        :param db_file: SQLiteデータベースファイルのパス
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        """
+        テーブルとインデックスを作成する
+        """
+        metric_columns = ', '.join(f'{metric} INTEGER' for metric in INSIGHTS_METRICS)
+        with self._lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS threads ('
+                'thread_id TEXT PRIMARY KEY, username TEXT NOT NULL, published_at REAL NOT NULL, synced_at REAL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_threads_published_at ON threads (published_at)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_threads_username ON threads (username, published_at)')
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS insights (thread_id TEXT PRIMARY KEY, {metric_columns})')
+            # 設定に指標が追加された場合は列を追加する
+            existing = {row['name'] for row in self.conn.execute('PRAGMA table_info(insights)')}
+            for metric in INSIGHTS_METRICS:
+                if metric not in existing:
+                    self.conn.execute(f'ALTER TABLE insights ADD COLUMN {metric} INTEGER')
+
+    def record_thread(self, username: str, thread_id: str, published_at: Optional[float] = None) -> None:
+        """
+        公開したスレッドを記録する
+
+        :param username: ユーザー名
+        :param thread_id: 公開されたスレッドのID
+        :param published_at: 公開時刻（省略時は現在時刻）
+        """
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR IGNORE INTO threads (thread_id, username, published_at) VALUES (?, ?, ?)',
+                (thread_id, username, published_at if published_at is not None else time.time())
+            )
+        logger.info(f"ユーザー '{username}' のスレッドを記録しました: {thread_id}")
+
+    def get_threads_to_sync(self, now: float) -> List[sqlite3.Row]:
+        """
+        鮮度期間内で、最小再取得間隔を過ぎたスレッドを返す
+
+        :param now: 現在時刻
+        :return: 同期対象のスレッド一覧
+        """
+        with self._lock:
+            return self.conn.execute(
+                'SELECT thread_id, username FROM threads WHERE published_at >= ? AND (synced_at IS NULL OR synced_at <= ?)',
+                (now - INSIGHTS_FRESHNESS_DAYS * 86400, now - INSIGHTS_MIN_REFRESH_MINUTES * 60)
+            ).fetchall()
+
+    def save_insights(self, thread_id: str, insights: Dict[str, int], synced_at: float) -> None:
+        """
+        取得したインサイトを保存する
+
+        :param thread_id: スレッドID
+        :param insights: {指標名: 値} の辞書
+        :param synced_at: 取得時刻
+        """
+        values = [insights.get(metric) for metric in INSIGHTS_METRICS]
+        placeholders = ', '.join('?' for _ in INSIGHTS_METRICS)
+        with self._lock, self.conn:
+            self.conn.execute(
+                f'INSERT OR REPLACE INTO insights (thread_id, {", ".join(INSIGHTS_METRICS)}) VALUES (?, {placeholders})',
+                [thread_id] + values
+            )
+            self.conn.execute('UPDATE threads SET synced_at = ? WHERE thread_id = ?', (synced_at, thread_id))
+
+    def query_top(self, metric: str, days: float, username: Optional[str] = None, limit: int = 10) -> List[sqlite3.Row]:
+        """
+        指定期間に公開したスレッドを指標の降順で返す
+        """
+        if metric not in INSIGHTS_METRICS:
+            raise ValueError(f"未対応の指標です: {metric}")
+        sql = (f'SELECT t.thread_id, t.username, t.published_at, i.{metric} AS value FROM threads t '
+               f'JOIN insights i ON i.thread_id = t.thread_id WHERE t.published_at >= ?')
+        params: list = [time.time() - days * 86400]
+        if username:
+            sql += ' AND t.username = ?'
+            params.append(username)
+        sql += f' ORDER BY i.{metric} DESC LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def query_summary(self, days: float) -> List[sqlite3.Row]:
+        """
+        指定期間に公開したスレッドの指標をアカウントごとに集計する
+        """
+        sums = ', '.join(f'SUM(i.{metric}) AS {metric}' for metric in INSIGHTS_METRICS)
+        with self._lock:
+            return self.conn.execute(
+                f'SELECT t.username, COUNT(*) AS posts, {sums} FROM threads t '
+                f'LEFT JOIN insights i ON i.thread_id = t.thread_id WHERE t.published_at >= ? '
+                f'GROUP BY t.username ORDER BY t.username',
+                (time.time() - days * 86400,)
+            ).fetchall()
+
+
+class TokenBucket:
+    """
+    トークンごとのリクエスト数を制限するトークンバケット
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: 1秒あたりに補充されるリクエスト数
+        :param capacity: バーストで許可する最大リクエスト数（省略時はrate）
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        リクエスト1回分の枠が空くまで待機する
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class InsightsSyncer:
+    """
+    鮮度期間内のスレッドのインサイトを並列に取得してストアに保存するクラス
+    """
+
+    def __init__(self, store: InsightsStore, user_manager: UserManager):
+        """
+        InsightsSyncerクラスのコンストラクタ
+
+        :param store: インサイトの保存先
+        :param user_manager: アクセストークンを取得するUserManager
+        """
+        self.store = store
+        self.user_manager = user_manager
+
+    def _fetch(self, client: ThreadsClient, bucket: TokenBucket, thread_id: str) -> Dict[str, int]:
+        bucket.acquire()
+        return client.get_thread_insights(thread_id, INSIGHTS_METRICS)
+
+    def sync(self) -> Dict[str, int]:
+        """
+        インサイトを差分同期する
+
+        :return: 同期件数（synced, failed, skipped）
+        """
+        start_time = time.time()
+        threads = self.store.get_threads_to_sync(start_time)
+        tokens = {user['username']: user['access_token'] for user in self.user_manager.get_users()}
+        clients: Dict[str, ThreadsClient] = {}
+        buckets: Dict[str, TokenBucket] = {}
+        counts = {"synced": 0, "failed": 0, "skipped": 0}
+        logger.info(f"インサイト同期を開始します: 対象 {len(threads)}件")
+
+        with ThreadPoolExecutor(max_workers=INSIGHTS_MAX_WORKERS) as executor:
+            futures = {}
+            for row in threads:
+                username = row['username']
+                if username not in tokens:
+                    logger.warning(f"ユーザー '{username}' のトークンがないためスキップします: {row['thread_id']}")
+                    counts["skipped"] += 1
+                    continue
+                if username not in clients:
+                    clients[username] = ThreadsClient(tokens[username], username)
+                    buckets[username] = TokenBucket(INSIGHTS_REQUESTS_PER_SECOND)
+                future = executor.submit(self._fetch, clients[username], buckets[username], row['thread_id'])
+                futures[future] = row['thread_id']
+
+            for future in as_completed(futures):
+                thread_id = futures[future]
+                try:
+                    self.store.save_insights(thread_id, future.result(), time.time())
+                    counts["synced"] += 1
+                except Exception as e:
+                    # 想定外の応答でも他の投稿の同期は続ける
+                    logger.error(f"インサイトの取得に失敗しました: スレッドID={thread_id}, エラー: {type(e).__name__}: {e}")
+                    counts["failed"] += 1
+
+        logger.info(f"インサイト同期完了: {counts}（{time.time() - start_time:.1f}秒）")
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Threads投稿のインサイトを同期・表示する")
+    parser.add_argument('--db', default=INSIGHTS_DB_FILE, help="インサイトDBファイル")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('sync', help="鮮度期間内の投稿のインサイトを取得する")
+
+    top_parser = subparsers.add_parser('top', help="指標の上位投稿を表示する")
+    top_parser.add_argument('--metric', default='views', choices=INSIGHTS_METRICS)
+    top_parser.add_argument('--days', type=float, default=7)
+    top_parser.add_argument('--user')
+    top_parser.add_argument('--limit', type=int, default=10)
+
+    summary_parser = subparsers.add_parser('summary', help="アカウントごとの合計を表示する")
+    summary_parser.add_argument('--days', type=float, default=7)
+
+    args = parser.parse_args()
+    store = InsightsStore(args.db)
+
+    if args.command == 'sync':
+        user_manager = UserManager("users.json", REPLIES_PARENT_FOLDER)
+        print(InsightsSyncer(store, user_manager).sync())
+    elif args.command == 'top':
+        for row in store.query_top(args.metric, args.days, args.user, args.limit):
+            published = time.strftime('%Y-%m-%d %H:%M', time.localtime(row['published_at']))
+            print(f"{published}  {row['username']:<20} {row['thread_id']:<20} {args.metric}={row['value']}")
+    elif args.command == 'summary':
+        print('\t'.join(['username', 'posts'] + INSIGHTS_METRICS))
+        for row in store.query_summary(args.days):
+            print('\t'.join(str(row[key] if row[key] is not None else 0) for key in ['username', 'posts'] + INSIGHTS_METRICS))
+
+if __name__ == "__main__":
+    main()
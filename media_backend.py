@@ -0,0 +1,216 @@
+import os
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from typing import Optional, Tuple
+from deadline import Deadline
+from run_ledger import StageMetrics
+from config import MEDIA_BACKEND, MEDIA_LOCAL_ROOT, MEDIA_LOCAL_BASE_URL, MEDIA_LOCAL_PORT, WATERMARK_USERNAME
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def file_digest(image_path: str) -> str:
+    """
+    画像ファイルの内容のSHA-256ハッシュ（16進数）を返す（同じ画像の再アップロードの判定に使用）
+    """
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaBackend:
+    """
+    画像を公開し、Threads APIに渡せる公開URLを返すメディアバックエンドの基底クラス
+    """
+
+    name = 'base'
+
+    def upload(self, image_path: str, username: str, deadline: Optional[Deadline] = None) -> str:
+        """
+        画像を公開し、その公開URLを返す
+
+        :param image_path: 画像ファイルのパス
+        :param username: 投稿するアカウントのユーザー名（透かしの印字に使用）
+        :param deadline: 処理期限（オプション）
+        :return: 画像の公開URL
+        """
+        return self.upload_with_size(image_path, username, deadline)[0]
+
+    def upload_with_size(self, image_path: str, username: str, deadline: Optional[Deadline] = None) -> Tuple[str, int]:
+        """
+        画像を公開し、その公開URLと実際に送信（書き込み）したバイト数を返す
+
+        公開済みの画像を再利用した場合、バイト数は0になります。
+
+        :return: (画像の公開URL, 送信したバイト数)
+        """
+        raise NotImplementedError
+
+    def upload_measured(self, image_path: str, username: str, deadline: Optional[Deadline] = None,
+                        metrics: Optional[StageMetrics] = None, stage: str = 'upload') -> str:
+        """
+        画像を公開し、所要時間を段階stageに、実際に送信したバイト数をアップロード量に加算する
+
+        :param metrics: 段階ごとの所要時間の集計先（オプション）
+        :param stage: 所要時間を加算する段階名（本投稿は'upload'、返信は'reply_upload'）
+        :return: 画像の公開URL
+        """
+        if not metrics:
+            return self.upload(image_path, username, deadline)
+        with metrics.stage(stage):
+            image_url, bytes_sent = self.upload_with_size(image_path, username, deadline)
+        # アップロード済みの画像を再利用した場合は0なので、アップロード量は画像の種類数に比例する
+        metrics.add_bytes(bytes_sent)
+        return image_url
+
+
+class CloudinaryBackend(MediaBackend):
+    """
+    Cloudinaryに画像をアップロードするバックエンド（ユーザー名の透かしに対応）
+    """
+
+    name = 'cloudinary'
+
+    def __init__(self):
+        # cloudinaryパッケージはこのバックエンドを使う場合のみ必要
+        from cloudinary_uploader import CloudinaryUploader
+        self.uploader = CloudinaryUploader()
+
+    def upload_with_size(self, image_path: str, username: str, deadline: Optional[Deadline] = None) -> Tuple[str, int]:
+        return self.uploader.upload_with_size(image_path, username, deadline)
+
+
+class LocalStaticBackend(MediaBackend):
+    """
+    画像を内容のハッシュ名でローカルのディレクトリに置き、自前のHTTPサーバーから配信するバックエンド
+
+    外部へのアップロードを行わないため、URLはすぐに返ります。
+    ファイル名が内容のハッシュなので、同じ画像は全アカウントで1つのファイルを共有します。
+    ディレクトリは `python media_backend.py serve` などでMEDIA_LOCAL_BASE_URLから公開しておく必要があります。
+    """
+
+    name = 'local'
+
+    # 同じ画像を複数のスレッドが同時に配置しないようにする（全インスタンスで共有）
+    _write_lock = threading.Lock()
+
+    def __init__(self, root: Optional[str] = None, base_url: Optional[str] = None):
+        """
+        LocalStaticBackendクラスのコンストラクタ
+
+        :param root: 画像を置くディレクトリ（省略時はMEDIA_LOCAL_ROOT）
+        :param base_url: rootを配信している公開URL（Threadsのサーバーから到達できる必要がある。省略時はMEDIA_LOCAL_BASE_URL）
+        """
+        # 設定の再読み込みを反映するため、既定値は呼び出し時に参照する
+        root = root or MEDIA_LOCAL_ROOT
+        base_url = base_url or MEDIA_LOCAL_BASE_URL
+        if not base_url:
+            raise ValueError("ローカルのメディアバックエンドにはMEDIA_LOCAL_BASE_URLの設定が必要です。")
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+        os.makedirs(root, exist_ok=True)
+        if WATERMARK_USERNAME:
+            logger.warning("ローカルのメディアバックエンドはユーザー名の透かしに対応していません。元画像をそのまま配信します。")
+        logger.info(f"ローカルのメディアバックエンドを初期化しました: {root} -> {self.base_url}")
+
+    def upload_with_size(self, image_path: str, username: str, deadline: Optional[Deadline] = None) -> Tuple[str, int]:
+        digest = file_digest(image_path)
+        extension = os.path.splitext(image_path)[1].lower() or '.jpg'
+        # 1ディレクトリのファイル数が増えすぎないよう、ハッシュの先頭2文字で分ける
+        relative_path = f"{digest[:2]}/{digest}{extension}"
+        dest = os.path.join(self.root, digest[:2], f"{digest}{extension}")
+        url = f"{self.base_url}/{relative_path}"
+        with self._write_lock:
+            if os.path.exists(dest):
+                # 配置済みの画像は書き込まない
+                return url, 0
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            # 配信中のファイルが書きかけにならないよう、一時ファイルに書いてから名前を変更する
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.tmp_')
+            os.close(fd)
+            try:
+                shutil.copyfile(image_path, tmp_path)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, dest)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        logger.info(f"画像を配信ディレクトリに配置しました: {dest}")
+        return url, os.path.getsize(dest)
+
+
+class StaticFileHandler(SimpleHTTPRequestHandler):
+    """
+    配信ディレクトリの画像を返すハンドラ（ファイル名が内容のハッシュなので長期間キャッシュさせる）
+
+    404などのエラー応答はキャッシュさせない（配置前のアクセスがプロキシに残らないようにする）。
+    """
+
+    def send_response(self, code, message=None):
+        self._status_code = code
+        super().send_response(code, message)
+
+    def end_headers(self):
+        if getattr(self, '_status_code', None) in (200, 304):
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        else:
+            self.send_header('Cache-Control', 'no-store')
+        super().end_headers()
+
+    def list_directory(self, path):
+        self.send_error(404)
+        return None
+
+
+def get_media_backend(name: str = None) -> MediaBackend:
+    """
+    設定（MEDIA_BACKEND）に応じたメディアバックエンドを作成する
+
+    :param name: バックエンド名（cloudinary または local）。省略時はMEDIA_BACKEND
+    :return: メディアバックエンド
+    """
+    name = name or MEDIA_BACKEND
+    if name == 'cloudinary':
+        return CloudinaryBackend()
+    if name == 'local':
+        return LocalStaticBackend()
+    raise ValueError(f"不明なメディアバックエンドです: {name}（cloudinary または local）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルのメディアバックエンドの配信ディレクトリを操作する")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help="配信ディレクトリをHTTPで配信する")
+    serve_parser.add_argument('--root', default=MEDIA_LOCAL_ROOT, help="配信ディレクトリ")
+    serve_parser.add_argument('--bind', default='0.0.0.0', help="待ち受けるアドレス")
+    serve_parser.add_argument('--port', type=int, default=MEDIA_LOCAL_PORT, help="待ち受けるポート")
+
+    put_parser = subparsers.add_parser('put', help="画像を配信ディレクトリに配置し、公開URLを表示する")
+    put_parser.add_argument('image_path', help="画像ファイルのパス")
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        os.makedirs(args.root, exist_ok=True)
+        server = ThreadingHTTPServer((args.bind, args.port), partial(StaticFileHandler, directory=args.root))
+        logger.info(f"配信を開始します: http://{args.bind}:{args.port}/ -> {args.root}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.command == 'put':
+        print(LocalStaticBackend().upload(args.image_path, ''))
+
+if __name__ == "__main__":
+    main()
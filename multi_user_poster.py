@@ -1,22 +1,59 @@
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict
+from typing import List, Dict, Optional
 from user_manager import UserManager
 from image_pair_poster import PostManager
-from reply_poster import ReplyPoster
 from image_pair_manager import PostContentManager
+from token_manager import TokenManager
+from insights import InsightsStore
 import random
 import time
-from config import REPLIES_PARENT_FOLDER, IMAGE_PAIRS_FOLDER
+from deadline import Deadline
+from run_ledger import StageMetrics
+from config import IMAGE_PAIRS_FOLDER, SLOT_DEADLINE_SECONDS, POST_DEADLINE_SECONDS
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class MultiUserPoster:
-    def __init__(self, user_manager: UserManager, image_pair_manager: PostContentManager):
+    def __init__(self, user_manager: UserManager, image_pair_manager: PostContentManager, token_manager: Optional[TokenManager] = None,
+                 insights_store: Optional[InsightsStore] = None):
         self.user_manager = user_manager
         self.image_pair_manager = image_pair_manager
+        self.token_manager = token_manager
+        self.insights_store = insights_store
+        # 変更のないアカウントの接続を再利用するため、アカウントごとのPostManagerを保持する
+        self._posters: Dict[str, PostManager] = {}
+
+    def _get_poster(self, user: Dict[str, str]) -> PostManager:
+        """
+        アカウントのPostManagerを返す（トークンが変わっていなければ使い回す）
+
+        :param user: ユーザー情報の辞書
+        :return: PostManager
+        """
+        poster = self._posters.get(user['username'])
+        if poster is None or poster.auth_token != user['access_token']:
+            poster = PostManager(user['access_token'], user['username'], IMAGE_PAIRS_FOLDER, self.image_pair_manager)
+            self._posters[user['username']] = poster
+        return poster
+
+    def invalidate_users(self, usernames: List[str]) -> None:
+        """
+        削除・更新されたアカウントのPostManagerを破棄する
+
+        :param usernames: 破棄するユーザー名の一覧
+        """
+        for username in usernames:
+            if self._posters.pop(username, None) is not None:
+                logger.info(f"ユーザー '{username}' のクライアントを破棄しました。")
+
+    def invalidate_all(self) -> None:
+        """
+        全アカウントのPostManagerを破棄する（設定の再読み込み後、次の投稿で新しい設定で作り直す）
+        """
+        self.invalidate_users(list(self._posters))
 
     def post_for_all_users(self) -> List[Dict[str, str]]:
         """
@@ -26,6 +63,17 @@ class MultiUserPoster:
         """
         users = self.user_manager.get_users()
         results = []
+        slot_deadline = Deadline(SLOT_DEADLINE_SECONDS)
+
+        # アップロードなどの重い処理の前に、失効したトークンのアカウントを除外する
+        if self.token_manager:
+            valid_users = self.token_manager.get_valid_users(users)
+            valid_usernames = {user['username'] for user in valid_users}
+            for user in users:
+                if user['username'] not in valid_usernames:
+                    results.append({"username": user['username'], "status": "error", "error_class": "InvalidToken",
+                                    "message": "アクセストークンが失効しています"})
+            users = valid_users
 
         # 1分から60分の間でランダムに待機時間を設定
         wait_time = random.randint(60, 3600)  # 60秒（1分）から3600秒（60分）の間
@@ -33,15 +81,19 @@ class MultiUserPoster:
         #time.sleep(wait_time)
 
         # アカウントごとに順番に処理を実行
-        results = []
         for i, user in enumerate(users):
+            if slot_deadline.expired():
+                logger.error(f"スロットの期限を過ぎたため、ユーザー '{user['username']}' の投稿を取りやめます。")
+                results.append({"username": user['username'], "status": "error", "error_class": "DeadlineExceeded",
+                                "message": "スロットの期限を過ぎました"})
+                continue
             try:
-                result = self._post_and_reply_for_user(user)
+                result = self._post_and_reply_for_user(user, slot_deadline.child(POST_DEADLINE_SECONDS))
                 results.append(result)
                 logger.info(f"ユーザー '{user['username']}' の投稿と返信が完了しました。")
             except Exception as exc:
                 logger.error(f"ユーザー '{user['username']}' の投稿中にエラーが発生しました: {exc}")
-                results.append({"username": user['username'], "status": "error", "message": str(exc)})
+                results.append({"username": user['username'], "status": "error", "error_class": type(exc).__name__, "message": str(exc)})
             
             # 最後のユーザーでない場合のみ待機
             if i < len(users) - 1:
@@ -69,11 +121,12 @@ class MultiUserPoster:
             return {"username": user['username'], "status": "error", "message": str(e)}
 
 
-    def _post_and_reply_for_user(self, user: Dict[str, str]) -> Dict[str, str]:
+    def _post_and_reply_for_user(self, user: Dict[str, str], deadline: Optional[Deadline] = None) -> Dict[str, str]:
         """
         単一ユーザーに対して投稿と返信を実行する
 
         :param user: ユーザー情報の辞書
+        :param deadline: この投稿の処理期限（オプション）
         :return: 投稿と返信の結果を含む辞書
         """
         logger.info(f"ユーザー '{user['username']}' の処理を開始します。")
@@ -81,33 +134,47 @@ class MultiUserPoster:
             "username": user['username'],
             "status": "success",
             "thread_id": None,
-            "reply_id": None
+            "reply_id": None,
+            "started_at": time.time()
         }
+        metrics = StageMetrics()
 
         try:
             # 画像ペアの投稿
-            poster = PostManager(user['access_token'], user['username'], IMAGE_PAIRS_FOLDER)
-            thread_id = poster.post_content()
+            poster = self._get_poster(user)
+            thread_id = poster.post_content(deadline, metrics)
             result["thread_id"] = thread_id
             logger.info(f"ユーザー '{user['username']}' の投稿が成功しました。スレッドID: {thread_id}")
-
-            # リプライフォルダが存在する場合のみ返信を投稿
-            if user.get('has_reply_folder', False):
-                reply_poster = ReplyPoster(user['access_token'], user['username'], REPLIES_PARENT_FOLDER)
-                reply_id = reply_poster.post_reply(thread_id)
-                if reply_id:
-                    result["reply_id"] = reply_id
-                    logger.info(f"ユーザー '{user['username']}' の返信が成功しました。返信ID: {reply_id}")
+            if self.insights_store:
+                try:
+                    self.insights_store.record_thread(user['username'], thread_id)
+                except Exception as e:
+                    # 記録の失敗（DBのロック等）で公開済みの投稿や返信の結果を変えない
+                    logger.warning(f"ユーザー '{user['username']}' の投稿をインサイトDBに記録できませんでした: {type(e).__name__}: {e}")
+
+            # 投稿フォルダまたはリプライフォルダに返信チェーンがある場合のみ返信を投稿
+            if poster.reply_chain:
+                reply_ids = poster.reply_poster.post_reply_chain(thread_id, poster.reply_chain, deadline)
+                if reply_ids:
+                    result["reply_id"] = reply_ids[0]
+                    result["reply_ids"] = reply_ids
+                    logger.info(f"ユーザー '{user['username']}' の返信が成功しました。返信ID: {', '.join(reply_ids)}")
                 else:
                     logger.info(f"ユーザー '{user['username']}' の返信は行われませんでした。")
             else:
-                logger.info(f"ユーザー '{user['username']}' はリプライフォルダを持っていないため、返信は行いません。")
+                logger.info(f"ユーザー '{user['username']}' は返信チェーンを持っていないため、返信は行いません。")
 
         except Exception as e:
             logger.error(f"ユーザー '{user['username']}' の処理中にエラーが発生しました: {str(e)}")
             result["status"] = "error"
+            result["error_class"] = type(e).__name__
             result["message"] = str(e)
 
+        # 実行台帳に記録するための所要時間とアップロード量
+        result["duration"] = round(time.time() - result["started_at"], 3)
+        result.update(metrics.to_dict())
+        result["stages"]["total"] = result["duration"]
+        logger.info(f"ユーザー '{user['username']}' のAPI呼び出し: {result['api_calls']}回（{result['duration']}秒）")
         return result
 
 
@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import heapq
+import random
+import logging
+import threading
+from typing import List, Dict, Optional, Tuple
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class PostHistory:
+    """
+    アカウントごとの投稿履歴を管理するクラス
+
+    履歴は {ユーザー名: {投稿ID: 最終投稿時刻(UNIX時間)}} の形式でJSONファイルに保存します。
+    """
+
+    def __init__(self, history_file: str):
+        """
+        PostHistoryクラスのコンストラクタ
+
+        :param history_file: 投稿履歴を保存するJSONファイルのパス
+        """
+        self.history_file = history_file
+        self.history: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._load_history()
+
+    def _load_history(self) -> None:
+        """
+        JSONファイルから投稿履歴を読み込む
+        """
+        if not os.path.exists(self.history_file):
+            logger.info(f"投稿履歴ファイル '{self.history_file}' が存在しないため、空の履歴で開始します。")
+            return
+        try:
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                self.history = json.load(f)
+            logger.info(f"投稿履歴を読み込みました: {len(self.history)}アカウント")
+        except json.JSONDecodeError:
+            logger.error(f"投稿履歴ファイル '{self.history_file}' の解析に失敗しました。空の履歴で開始します。")
+            self.history = {}
+
+    def _save_history(self) -> None:
+        """
+        投稿履歴をJSONファイルに保存する（一時ファイル経由で置き換え）
+        """
+        tmp_file = f"{self.history_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.history, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.history_file)
+        except IOError:
+            logger.error(f"投稿履歴の保存中にエラーが発生しました。")
+            raise
+
+    def get_user_history(self, username: str) -> Dict[str, float]:
+        """
+        指定ユーザーの投稿履歴を返す
+
+        :param username: ユーザー名
+        :return: {投稿ID: 最終投稿時刻} の辞書
+        """
+        with self._lock:
+            return dict(self.history.get(username, {}))
+
+    def record(self, username: str, post_id: str, posted_at: Optional[float] = None) -> float:
+        """
+        投稿を履歴に記録して保存する
+
+        :param username: ユーザー名
+        :param post_id: 投稿ID（投稿フォルダ名）
+        :param posted_at: 投稿時刻（省略時は現在時刻）
+        :return: 記録した投稿時刻
+        """
+        posted_at = posted_at if posted_at is not None else time.time()
+        with self._lock:
+            self.history.setdefault(username, {})[post_id] = posted_at
+            self._save_history()
+        logger.info(f"ユーザー '{username}' の投稿履歴を記録しました: {post_id}")
+        return posted_at
+
+
+class WeightedSampler:
+    """
+    Fenwick木（Binary Indexed Tree）による重み付きサンプラー
+
+    重みの更新とサンプリングをいずれもO(log n)で行います。
+    """
+
+    def __init__(self, weights: List[float]):
+        """
+        WeightedSamplerクラスのコンストラクタ（O(n)で木を構築）
+
+        :param weights: 各要素の初期重み
+        """
+        self.size = len(weights)
+        self.weights = list(weights)
+        self.tree = [0.0] * (self.size + 1)
+        for i, weight in enumerate(self.weights, start=1):
+            self.tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+        self._top_bit = 1 << (self.size.bit_length() - 1) if self.size else 0
+
+    def total(self) -> float:
+        """
+        重みの合計を返す
+        """
+        total = 0.0
+        i = self.size
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def update(self, index: int, weight: float) -> None:
+        """
+        指定要素の重みを更新する
+
+        :param index: 要素のインデックス（0始まり）
+        :param weight: 新しい重み
+        """
+        delta = weight - self.weights[index]
+        if delta == 0:
+            return
+        self.weights[index] = weight
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def sample(self, rng: random.Random = random) -> Optional[int]:
+        """
+        重みに比例した確率で要素を1つ選ぶ
+
+        :param rng: 乱数生成器
+        :return: 選ばれた要素のインデックス。重みの合計が0の場合はNone
+        """
+        total = self.total()
+        if total <= 0:
+            return None
+        target = rng.random() * total
+        pos = 0
+        step = self._top_bit
+        while step:
+            next_pos = pos + step
+            if next_pos <= self.size and self.tree[next_pos] <= target:
+                pos = next_pos
+                target -= self.tree[pos]
+            step >>= 1
+        # 浮動小数点誤差で重み0の要素に落ちた場合は最後の正の重みの要素を使う
+        if pos >= self.size or self.weights[pos] <= 0:
+            pos = max(i for i in range(self.size) if self.weights[i] > 0)
+        return pos
+
+
+class _UserPostIndex:
+    """
+    ユーザー1人分の投稿ID一覧と重み付きサンプラーのキャッシュ
+    """
+
+    def __init__(self, post_ids: List[str], folder_mtime: float):
+        self.post_ids = post_ids
+        self.positions = {post_id: i for i, post_id in enumerate(post_ids)}
+        self.folder_mtime = folder_mtime
+        self.sampler: Optional[WeightedSampler] = None
+        # インデックスごとの最終投稿時刻
+        self.posted_at: Dict[int, float] = {}
+        # (次に重みを更新する時刻, インデックス) のヒープ。再投稿で古くなった要素は取り出し時に読み飛ばす
+        self.updates: List = []
+        # インデックスごとの次に重みを更新する時刻
+        self.next_update: Dict[int, float] = {}
+        # 無効として抽選対象から外したインデックス
+        self.excluded = set()
+
+
+class PostSelector:
+    """
+    投稿履歴を考慮して次の投稿を選ぶクラス
+
+    クールダウン中の投稿は重み0、未投稿の投稿は再投稿より大きい重みで抽選します。
+    クールダウンが明けた投稿は、前回の投稿から時間が経つほど重みが大きくなります（未投稿の重みは超えない）。
+    投稿フォルダの一覧はフォルダの更新時刻が変わった場合のみ再スキャンします。
+    """
+
+    # 再投稿の重みを大きくする最大段階数（前回の投稿からの経過時間が倍になるごとに1段階）
+    MAX_AGE_STEPS = 16
+
+    def __init__(self, history: PostHistory, cooldown_hours: float, unposted_weight: float, reposted_weight: float):
+        """
+        PostSelectorクラスのコンストラクタ
+
+        :param history: 投稿履歴
+        :param cooldown_hours: 同じ投稿を再度選べるようになるまでの時間
+        :param unposted_weight: 一度も投稿していない投稿の重み
+        :param reposted_weight: クールダウンが明けた直後の投稿済みの投稿の重み
+        """
+        self.history = history
+        self.cooldown_seconds = cooldown_hours * 3600
+        # 経過時間の基準（クールダウンなしの場合は1日）
+        self.age_unit = self.cooldown_seconds if self.cooldown_seconds > 0 else 86400
+        self.unposted_weight = unposted_weight
+        self.reposted_weight = reposted_weight
+        self._indexes: Dict[str, _UserPostIndex] = {}
+        self._lock = threading.Lock()
+
+    def _repost_weight(self, posted_at: float, now: float) -> Tuple[float, Optional[float]]:
+        """
+        投稿済みの投稿の現在の重みと、次に重みが変わる時刻を求める
+
+        クールダウン中は0。明けた後はreposted_weightから始まり、経過時間がクールダウンの2倍、4倍、8倍…に
+        なるごとに未投稿の重みとの差の半分ずつ近づきます。
+
+        :return: (重み, 次に重みが変わる時刻。これ以上変わらない場合はNone)
+        """
+        age = now - posted_at
+        if age < self.cooldown_seconds:
+            return 0.0, posted_at + self.cooldown_seconds
+        steps = 0
+        while steps < self.MAX_AGE_STEPS and age >= self.age_unit * 2 ** (steps + 1):
+            steps += 1
+        weight = self.unposted_weight - (self.unposted_weight - self.reposted_weight) * 0.5 ** steps
+        next_update = posted_at + self.age_unit * 2 ** (steps + 1) if steps < self.MAX_AGE_STEPS else None
+        return weight, next_update
+
+    def _schedule_update(self, index: _UserPostIndex, i: int, next_update: Optional[float]) -> None:
+        """
+        次に重みを更新する時刻を登録する
+        """
+        if next_update is None:
+            index.next_update.pop(i, None)
+            return
+        index.next_update[i] = next_update
+        heapq.heappush(index.updates, (next_update, i))
+
+    def _build_index(self, username: str, user_folder: str, folder_mtime: float) -> _UserPostIndex:
+        """
+        投稿フォルダをスキャンしてサンプラーを構築する
+        """
+        with os.scandir(user_folder) as entries:
+            post_ids = sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+        index = _UserPostIndex(post_ids, folder_mtime)
+        user_history = self.history.get_user_history(username)
+        now = time.time()
+        weights = []
+        for i, post_id in enumerate(post_ids):
+            posted_at = user_history.get(post_id)
+            if posted_at is None:
+                weights.append(self.unposted_weight)
+                continue
+            weight, next_update = self._repost_weight(posted_at, now)
+            weights.append(weight)
+            index.posted_at[i] = posted_at
+            if next_update is not None:
+                index.updates.append((next_update, i))
+                index.next_update[i] = next_update
+        heapq.heapify(index.updates)
+        index.sampler = WeightedSampler(weights)
+        cooling = sum(1 for weight in weights if weight == 0)
+        logger.info(f"ユーザー '{username}' の投稿インデックスを構築しました: {len(post_ids)}件（クールダウン中: {cooling}件）")
+        return index
+
+    def _get_index(self, username: str, user_folder: str) -> Optional[_UserPostIndex]:
+        """
+        キャッシュ済みのインデックスを返す。フォルダが更新されていれば再構築する
+        """
+        try:
+            folder_mtime = os.stat(user_folder).st_mtime
+        except FileNotFoundError:
+            self._indexes.pop(username, None)
+            return None
+        index = self._indexes.get(username)
+        if index is None or index.folder_mtime != folder_mtime:
+            index = self._build_index(username, user_folder, folder_mtime)
+            self._indexes[username] = index
+        return index
+
+    def _refresh_weights(self, index: _UserPostIndex, now: float) -> None:
+        """
+        クールダウンが明けた投稿と、経過時間で重みが変わる投稿の重みを更新する
+        """
+        while index.updates and index.updates[0][0] <= now:
+            scheduled_at, i = heapq.heappop(index.updates)
+            if index.next_update.get(i) != scheduled_at:
+                continue
+            weight, next_update = self._repost_weight(index.posted_at[i], now)
+            if i not in index.excluded:
+                index.sampler.update(i, weight)
+            self._schedule_update(index, i, next_update)
+
+    def select(self, username: str, user_folder: str) -> Optional[str]:
+        """
+        次に投稿する投稿IDを選ぶ
+
+        全ての投稿がクールダウン中の場合は、最も前に投稿した投稿を返します。
+
+        :param username: ユーザー名
+        :param user_folder: ユーザーの投稿フォルダ
+        :return: 選ばれた投稿ID。投稿が存在しない場合はNone
+        """
+        with self._lock:
+            index = self._get_index(username, user_folder)
+            if index is None or not index.post_ids:
+                return None
+            self._refresh_weights(index, time.time())
+            i = index.sampler.sample()
+            if i is None:
+                waiting = [(posted_at, i) for i, posted_at in index.posted_at.items() if i not in index.excluded]
+                if not waiting:
+                    return None
+                i = min(waiting)[1]
+                logger.warning(f"ユーザー '{username}' の投稿は全てクールダウン中です。最も前に投稿した投稿を選びます。")
+            return index.post_ids[i]
+
+    def exclude(self, username: str, post_id: str) -> None:
+        """
+        無効な投稿をフォルダが更新されるまで抽選対象から外す
+
+        :param username: ユーザー名
+        :param post_id: 投稿ID
+        """
+        with self._lock:
+            index = self._indexes.get(username)
+            if index and post_id in index.positions:
+                i = index.positions[post_id]
+                index.excluded.add(i)
+                index.sampler.update(i, 0.0)
+
+    def mark_posted(self, username: str, post_id: str) -> None:
+        """
+        投稿済みとして履歴に記録し、クールダウンを開始する
+
+        :param username: ユーザー名
+        :param post_id: 投稿ID
+        """
+        posted_at = self.history.record(username, post_id)
+        with self._lock:
+            index = self._indexes.get(username)
+            if index and post_id in index.positions:
+                i = index.positions[post_id]
+                index.posted_at[i] = posted_at
+                weight, next_update = self._repost_weight(posted_at, posted_at)
+                if i not in index.excluded:
+                    index.sampler.update(i, weight)
+                self._schedule_update(index, i, next_update)
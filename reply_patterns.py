@@ -0,0 +1,6 @@
+import re
+
+# 返信チェーンのファイル名: reply.txt / reply_image.jpg（1件のみ）または reply1.txt / reply1_image.jpg, reply2.txt ...
+# 投稿処理（reply_poster）と取り込み（ingest_posts）の両方で使うため、依存のないモジュールに置く
+REPLY_TEXT_PATTERN = re.compile(r'^reply(\d*)\.txt$')
+REPLY_IMAGE_PATTERN = re.compile(r'^reply(\d*)_image\.jpg$')
@@ -1,14 +1,74 @@
 import logging
-import time
-from typing import Dict, Optional
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Optional
 import os
 from base_post import ThreadsClient
-from cloudinary_uploader import CloudinaryUploader
+from media_backend import get_media_backend
+from deadline import Deadline
+from run_ledger import StageMetrics
+from reply_patterns import REPLY_TEXT_PATTERN, REPLY_IMAGE_PATTERN
+from config import REPLY_MIN_REMAINING_SECONDS, REPLY_UPLOAD_MAX_WORKERS
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def load_reply_chain(folder: str) -> List[Dict[str, Optional[str]]]:
+    """
+    フォルダから返信チェーンを読み込む
+
+    reply1.txt, reply2.txt ... の順に返信し、各返信は1つ前の返信への返信として投稿されます。
+    番号なしのreply.txtは最初の返信として扱います。
+
+    :param folder: 返信ファイルを含むフォルダ
+    :return: 返信テキストと画像パスを含む辞書のリスト（返信順）
+    """
+    if not folder or not os.path.isdir(folder):
+        return []
+    steps: Dict[int, Dict[str, Optional[str]]] = {}
+    for name in os.listdir(folder):
+        text_match = REPLY_TEXT_PATTERN.match(name)
+        image_match = REPLY_IMAGE_PATTERN.match(name)
+        if text_match:
+            step = steps.setdefault(int(text_match.group(1) or 0), {"text": None, "image_path": None})
+            with open(os.path.join(folder, name), 'r', encoding='utf-8') as f:
+                step["text"] = f.read().strip()
+        elif image_match:
+            step = steps.setdefault(int(image_match.group(1) or 0), {"text": None, "image_path": None})
+            step["image_path"] = os.path.join(folder, name)
+
+    chain = []
+    for number in sorted(steps):
+        if not steps[number]["text"]:
+            logger.warning(f"返信テキストが見つからないため、返信{number or ''}をスキップします: {folder}")
+            continue
+        chain.append(steps[number])
+    return chain
+
+
+class ReplyChain:
+    """
+    投稿前に準備した返信チェーン（画像は並列にアップロード中）
+    """
+
+    def __init__(self, steps: List[Dict[str, Optional[str]]], image_urls: List[Optional[Future]], metrics: Optional[StageMetrics] = None):
+        self.steps = steps
+        self.image_urls = image_urls
+        self.metrics = metrics
+
+    def __len__(self):
+        return len(self.steps)
+
+    def cancel(self) -> None:
+        """
+        まだ開始していないアップロードを取り消す（本投稿に失敗した場合など）
+        """
+        for future in self.image_urls:
+            if future:
+                future.cancel()
+
+
 class ReplyPoster:
     def __init__(self, auth_token: str, username: str, replies_parent_folder: str):
         """
@@ -18,87 +78,115 @@ class ReplyPoster:
         :param username: ユーザー名
         :param replies_parent_folder: リプライ用フォルダの親フォルダのパス
         """
-        self.threads_client = ThreadsClient(auth_token, username)
-        self.cloudinary_uploader = CloudinaryUploader()
+        # 返信のコンテナ作成・公開は本投稿と区別して集計する（reply_container, reply_publish）
+        self.threads_client = ThreadsClient(auth_token, username, stage_prefix='reply_')
+        self.media_backend = get_media_backend()
         self.username = username
         self.replies_parent_folder = replies_parent_folder
         self.reply_folder = os.path.join(replies_parent_folder, username)
+        self._upload_executor = ThreadPoolExecutor(max_workers=REPLY_UPLOAD_MAX_WORKERS, thread_name_prefix=f'reply-upload-{username}')
         logger.info(f"ReplyPosterが初期化されました。ユーザー: {username}, リプライフォルダ: {self.reply_folder}")
 
-    def _load_reply_content(self) -> Dict[str, Optional[str]]:
+    def _upload(self, image_path: str, deadline: Optional[Deadline], metrics: Optional[StageMetrics]) -> str:
+        return self.media_backend.upload_measured(image_path, self.username, deadline, metrics, 'reply_upload')
+
+    def prepare_chain(self, post_folder: Optional[str] = None, deadline: Optional[Deadline] = None,
+                      metrics: Optional[StageMetrics] = None) -> ReplyChain:
+        """
+        返信チェーンを読み込み、全ての返信画像のアップロードを並列に開始する
+
+        本投稿の処理中にアップロードを進めておくことで、返信時には公開処理だけが残ります。
+        投稿フォルダに返信ファイルがあればそれを、なければアカウントのリプライフォルダを使います。
+
+        :param post_folder: 投稿フォルダのパス（オプション）
+        :param deadline: 処理期限（オプション）
+        :param metrics: 段階ごとの所要時間の集計先（オプション）
+        :return: 準備済みの返信チェーン
+        """
+        steps = load_reply_chain(post_folder) or load_reply_chain(self.reply_folder)
+        image_urls = [
+            self._upload_executor.submit(self._upload, step["image_path"], deadline, metrics)
+            if step["image_path"] else None
+            for step in steps
+        ]
+        if steps:
+            logger.info(f"ユーザー '{self.username}' の返信チェーンを準備しました: {len(steps)}件（画像 {sum(1 for f in image_urls if f)}件をアップロード中）")
+        return ReplyChain(steps, image_urls, metrics)
+
+    def post_reply_chain(self, thread_id: str, chain: ReplyChain, deadline: Optional[Deadline] = None) -> List[str]:
         """
-        リプライフォルダから返信内容を読み込む
+        準備済みの返信チェーンを順番に投稿する（各返信は1つ前の返信への返信）
 
-        :return: 返信テキストと画像パスを含む辞書
+        :param thread_id: 最初の返信の返信先スレッドID
+        :param chain: prepare_chainで準備した返信チェーン
+        :param deadline: 処理期限（オプション）。残り時間が足りない場合は以降の返信を取りやめる
+        :return: 投稿された返信IDのリスト（返信順）
         """
-        reply_text_path = os.path.join(self.reply_folder, 'reply.txt')
-        reply_image_path = os.path.join(self.reply_folder, 'reply_image.jpg')
-
-        reply_text = None
-        reply_image = None
-
-        # テキストファイルの読み込み
-        if os.path.exists(reply_text_path):
-            with open(reply_text_path, 'r', encoding='utf-8') as f:
-                reply_text = f.read().strip()
-            logger.info(f"リプライテキストを読み込みました: {reply_text[:30]}...")
-        else:
-            logger.warning(f"リプライテキストファイルが見つかりません: {reply_text_path}")
-
-        # 画像ファイルの確認
-        if os.path.exists(reply_image_path):
-            reply_image = reply_image_path
-            logger.info(f"リプライ画像を見つけました: {reply_image}")
-        else:
-            logger.info("リプライ画像が見つかりません。テキストのみの返信を行います。")
-
-        return {"text": reply_text, "image_path": reply_image}
-
-    def post_reply(self, thread_id: str) -> Optional[str]:
+        self.threads_client.metrics = chain.metrics
+        reply_ids = []
+        reply_to_id = thread_id
+        for i, step in enumerate(chain.steps):
+            if deadline and deadline.remaining() < REPLY_MIN_REMAINING_SECONDS:
+                logger.warning(f"期限までの残り時間（{deadline.remaining():.1f}秒）が少ないため、残り{len(chain) - i}件の返信を取りやめます。")
+                break
+
+            image_url = None
+            if chain.image_urls[i]:
+                try:
+                    image_url = chain.image_urls[i].result()
+                    logger.info(f"画像のアップロードに成功しました: {image_url}")
+                except Exception as e:
+                    logger.error(f"画像のアップロード中にエラーが発生しました: {str(e)}")
+                    # 画像アップロードに失敗しても、テキストのみで返信を続行
+                    logger.info("画像なしで返信を続行します。")
+
+            try:
+                with chain.metrics.stage('reply') if chain.metrics else nullcontext():
+                    if image_url:
+                        reply_container_id = self.threads_client.create_reply(reply_to_id, step['text'], image_url, deadline=deadline)
+                        logger.info(f"返信コンテナの作成に成功しました（{i + 1}/{len(chain)}）。公開前にサーバーの処理を待機します。")
+                        self.threads_client.wait_for_container(reply_container_id, deadline=deadline)  # サーバーの処理を待機
+
+                        reply_id = self.threads_client.publish_reply(reply_container_id, deadline=deadline)
+                    else:
+                        # テキストのみの返信は処理待ちが不要で、可能なら1回のリクエストで公開する
+                        reply_id = self.threads_client.post_text_reply(reply_to_id, step['text'], deadline=deadline)
+                logger.info(f"返信の投稿に成功しました（{i + 1}/{len(chain)}）。返信ID: {reply_id}")
+            except Exception as e:
+                logger.error(f"返信の投稿中にエラーが発生しました: {str(e)}")
+                if not reply_ids:
+                    raise
+                logger.warning(f"返信チェーンを中断します。投稿済み: {len(reply_ids)}/{len(chain)}件")
+                break
+            reply_ids.append(reply_id)
+            reply_to_id = reply_id
+        return reply_ids
+
+    def post_reply(self, thread_id: str, deadline: Optional[Deadline] = None) -> Optional[str]:
         """
-        指定されたスレッドに返信を投稿する
+        指定されたスレッドにアカウントのリプライフォルダの返信チェーンを投稿する
 
         :param thread_id: 返信先のスレッドID
-        :return: 投稿された返信のID、またはNone（リプライフォルダが存在しない場合）
+        :param deadline: 処理期限（オプション）。残り時間が足りない場合は返信を取りやめる
+        :return: 最初の返信のID、またはNone（リプライフォルダが存在しない場合）
         """
         if not os.path.exists(self.reply_folder):
             logger.info(f"ユーザー '{self.username}' のリプライフォルダが見つかりません。リプライは行いません。")
             return None
 
         logger.info(f"返信の投稿を開始: スレッドID={thread_id}")
-        
-        reply_content = self._load_reply_content()
-        
-        if not reply_content['text']:
+        chain = self.prepare_chain(deadline=deadline)
+        if not chain:
             logger.error("返信テキストが見つかりません。返信を投稿できません。")
             return None
 
-        image_url = None
-        if reply_content['image_path']:
-            try:
-                image_url = self.cloudinary_uploader.upload(reply_content['image_path'], self.username)
-                logger.info(f"画像のアップロードに成功しました: {image_url}")
-            except Exception as e:
-                logger.error(f"画像のアップロード中にエラーが発生しました: {str(e)}")
-                # 画像アップロードに失敗しても、テキストのみで返信を続行
-                logger.info("画像なしで返信を続行します。")
-
-        try:
-            reply_container_id = self.threads_client.create_reply(thread_id, reply_content['text'], image_url)
-            logger.info("返信コンテナの作成に成功しました。公開前に30秒待機します。")
-            time.sleep(30)  # サーバーの処理を待機
-
-            reply_id = self.threads_client.publish_reply(reply_container_id)
-            logger.info(f"返信の投稿に成功しました。返信ID: {reply_id}")
-            return reply_id
-        except Exception as e:
-            logger.error(f"返信の投稿中にエラーが発生しました: {str(e)}")
-            raise
+        reply_ids = self.post_reply_chain(thread_id, chain, deadline)
+        return reply_ids[0] if reply_ids else None
 
 # 使用例
 if __name__ == "__main__":
-    from config import THREADS_AUTH_TOKEN
-    reply_poster = ReplyPoster(THREADS_AUTH_TOKEN, "test_user")
+    from config import THREADS_AUTH_TOKEN, REPLIES_PARENT_FOLDER
+    reply_poster = ReplyPoster(THREADS_AUTH_TOKEN, "test_user", REPLIES_PARENT_FOLDER)
     thread_id = "existing_thread_id"  # 既存の投稿のIDを指定
-    reply_id = reply_poster.post_reply(thread_id, "これは返信テストです。", "path/to/image.jpg")
-    print(f"返信ID: {reply_id}")
\ No newline at end of file
+    reply_id = reply_poster.post_reply(thread_id)
+    print(f"返信ID: {reply_id}")
@@ -0,0 +1,228 @@
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import List, Dict, Optional
+from config import RUN_LEDGER_DB_FILE
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class StageMetrics:
+    """
+    1アカウント分の処理の段階ごとの所要時間、アップロード量、API呼び出し回数を集計するクラス
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = defaultdict(float)
+        self.bytes_uploaded = 0
+        self.api_calls = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        with文で囲んだ処理の所要時間を段階nameに加算する（失敗した場合も計測する）
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self._lock:
+                self.durations[name] += elapsed
+
+    def add_bytes(self, size: int) -> None:
+        with self._lock:
+            self.bytes_uploaded += size
+
+    def add_api_call(self) -> None:
+        with self._lock:
+            self.api_calls += 1
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {"stages": {name: round(value, 3) for name, value in self.durations.items()},
+                    "bytes_uploaded": self.bytes_uploaded, "api_calls": self.api_calls}
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """
+    最近順位法でパーセンタイルを求める
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+class RunLedger:
+    """
+    スケジュール実行・アカウントごとの結果・段階ごとの所要時間を記録するSQLite台帳
+    """
+
+    def __init__(self, db_file: str = RUN_LEDGER_DB_FILE):
+        """
+        RunLedgerクラスのコンストラクタ
+
+        :param db_file: SQLiteデータベースファイルのパス
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        """
+        テーブルとインデックスを作成する
+        """
+        with self._lock, self.conn:
+            self.conn.executescript(
+                'CREATE TABLE IF NOT EXISTS runs ('
+                '  run_id INTEGER PRIMARY KEY, slot TEXT, started_at REAL NOT NULL, finished_at REAL NOT NULL,'
+                '  accounts INTEGER NOT NULL, succeeded INTEGER NOT NULL);'
+                'CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs (started_at);'
+                'CREATE TABLE IF NOT EXISTS account_runs ('
+                '  account_run_id INTEGER PRIMARY KEY, run_id INTEGER NOT NULL, username TEXT NOT NULL,'
+                '  started_at REAL, duration REAL, status TEXT NOT NULL, thread_id TEXT, reply_ids TEXT,'
+                '  error_class TEXT, message TEXT, bytes_uploaded INTEGER, api_calls INTEGER);'
+                'CREATE INDEX IF NOT EXISTS idx_account_runs_started_at ON account_runs (started_at);'
+                'CREATE INDEX IF NOT EXISTS idx_account_runs_username ON account_runs (username, started_at);'
+                'CREATE TABLE IF NOT EXISTS stage_timings ('
+                '  account_run_id INTEGER NOT NULL, stage TEXT NOT NULL, duration REAL NOT NULL,'
+                '  PRIMARY KEY (account_run_id, stage)) WITHOUT ROWID;'
+            )
+            # api_calls列がない古い台帳に列を追加する
+            columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(account_runs)')}
+            if 'api_calls' not in columns:
+                self.conn.execute('ALTER TABLE account_runs ADD COLUMN api_calls INTEGER')
+
+    def record_run(self, slot: Optional[str], started_at: float, finished_at: float, results: List[Dict]) -> int:
+        """
+        1回のスケジュール実行の結果を記録する
+
+        :param slot: スケジュール時刻（HH:MM形式）
+        :param started_at: 実行開始時刻
+        :param finished_at: 実行終了時刻
+        :param results: post_for_all_usersが返した結果のリスト
+        :return: 記録した実行のID
+        """
+        succeeded = sum(1 for result in results if result.get('status') == 'success')
+        with self._lock, self.conn:
+            run_id = self.conn.execute(
+                'INSERT INTO runs (slot, started_at, finished_at, accounts, succeeded) VALUES (?, ?, ?, ?, ?)',
+                (slot, started_at, finished_at, len(results), succeeded)
+            ).lastrowid
+            for result in results:
+                account_run_id = self.conn.execute(
+                    'INSERT INTO account_runs (run_id, username, started_at, duration, status, thread_id, reply_ids,'
+                    ' error_class, message, bytes_uploaded, api_calls) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (run_id, result['username'], result.get('started_at', started_at), result.get('duration'),
+                     result['status'], result.get('thread_id'),
+                     json.dumps(result['reply_ids']) if result.get('reply_ids') else None,
+                     result.get('error_class'), result.get('message'), result.get('bytes_uploaded'),
+                     result.get('api_calls'))
+                ).lastrowid
+                self.conn.executemany(
+                    'INSERT INTO stage_timings (account_run_id, stage, duration) VALUES (?, ?, ?)',
+                    [(account_run_id, stage, duration) for stage, duration in result.get('stages', {}).items()]
+                )
+        logger.info(f"実行結果を台帳に記録しました: 実行ID={run_id}, 成功 {succeeded}/{len(results)}アカウント")
+        return run_id
+
+    def stage_latency(self, stage: str, since: float, p: float) -> List[Dict]:
+        """
+        アカウントごとの段階の所要時間のパーセンタイルを返す
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT a.username, s.duration FROM account_runs a '
+                'JOIN stage_timings s ON s.account_run_id = a.account_run_id '
+                'WHERE a.started_at >= ? AND s.stage = ?',
+                (since, stage)
+            ).fetchall()
+        durations = defaultdict(list)
+        for row in rows:
+            durations[row['username']].append(row['duration'])
+        return [{"username": username, "count": len(values), "percentile": percentile(values, p), "max": max(values)}
+                for username, values in sorted(durations.items())]
+
+    def slot_trend(self, since: float) -> List[sqlite3.Row]:
+        """
+        日付・スロットごとの完了までの時間と成功数を返す
+        """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT date(started_at, 'unixepoch', 'localtime') AS day, slot, finished_at - started_at AS duration,"
+                " succeeded, accounts FROM runs WHERE started_at >= ? ORDER BY started_at",
+                (since,)
+            ).fetchall()
+
+    def failures(self, since: float) -> List[sqlite3.Row]:
+        """
+        アカウント・エラー種別ごとの失敗件数を返す
+        """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT username, error_class, COUNT(*) AS count FROM account_runs"
+                " WHERE started_at >= ? AND status != 'success' GROUP BY username, error_class ORDER BY count DESC",
+                (since,)
+            ).fetchall()
+
+    def api_calls(self, since: float) -> List[sqlite3.Row]:
+        """
+        アカウントごとの1投稿あたりのAPI呼び出し回数を返す
+        """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT username, COUNT(*) AS posts, AVG(api_calls) AS average, MAX(api_calls) AS max FROM account_runs"
+                " WHERE started_at >= ? AND status = 'success' AND api_calls IS NOT NULL GROUP BY username ORDER BY username",
+                (since,)
+            ).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="実行台帳を集計する")
+    parser.add_argument('--db', default=RUN_LEDGER_DB_FILE, help="台帳DBファイル")
+    parser.add_argument('--days', type=float, default=7, help="集計期間（日）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    latency_parser = subparsers.add_parser('latency', help="アカウントごとの段階の所要時間（パーセンタイル）")
+    latency_parser.add_argument('--stage', default='publish',
+                                help="段階名（upload, container, wait, publish, reply, reply_container, reply_publish, total）")
+    latency_parser.add_argument('--percentile', type=float, default=95)
+
+    subparsers.add_parser('slots', help="スロットごとの完了時間の推移")
+    subparsers.add_parser('failures', help="アカウント・エラー種別ごとの失敗件数")
+    subparsers.add_parser('calls', help="アカウントごとの1投稿あたりのAPI呼び出し回数")
+
+    args = parser.parse_args()
+    ledger = RunLedger(args.db)
+    since = time.time() - args.days * 86400
+
+    if args.command == 'latency':
+        print(f"username\tcount\tp{args.percentile:g}\tmax")
+        for row in ledger.stage_latency(args.stage, since, args.percentile):
+            print(f"{row['username']}\t{row['count']}\t{row['percentile']:.2f}\t{row['max']:.2f}")
+    elif args.command == 'slots':
+        print("day\tslot\tduration\tsucceeded/accounts")
+        for row in ledger.slot_trend(since):
+            print(f"{row['day']}\t{row['slot']}\t{row['duration']:.1f}\t{row['succeeded']}/{row['accounts']}")
+    elif args.command == 'failures':
+        print("username\terror_class\tcount")
+        for row in ledger.failures(since):
+            print(f"{row['username']}\t{row['error_class']}\t{row['count']}")
+    elif args.command == 'calls':
+        print("username\tposts\taverage\tmax")
+        for row in ledger.api_calls(since):
+            print(f"{row['username']}\t{row['posts']}\t{row['average']:.1f}\t{row['max']}")
+
+if __name__ == "__main__":
+    main()
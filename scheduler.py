@@ -1,12 +1,20 @@
 import schedule
 import time
 import json
+import os
+import re
 import logging
 from typing import List, Dict
 from datetime import datetime, timedelta
 from multi_user_poster import MultiUserPoster
 from user_manager import UserManager
 from image_pair_manager import PostContentManager
+from token_manager import TokenManager
+from insights import InsightsStore
+from run_ledger import RunLedger
+from config_watcher import ConfigWatcher, reload_settings
+import config
+from config import TOKEN_PRECHECK_MINUTES
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,17 +26,35 @@ class Scheduler:
         self.user_manager = user_manager
         self.image_pair_manager = image_pair_manager
         self.schedule_config: List[Dict[str, str]] = []
-        self.multi_user_poster = MultiUserPoster(user_manager, image_pair_manager)
+        self.token_manager = TokenManager(user_manager)
+        self.insights_store = InsightsStore()
+        self.run_ledger = RunLedger()
+        self.multi_user_poster = MultiUserPoster(user_manager, image_pair_manager, self.token_manager, self.insights_store)
         self._load_config()
+        self.config_watcher = ConfigWatcher([config_file, user_manager.users_file, config.__file__])
+
+    def _read_config(self) -> List[Dict[str, str]]:
+        """
+        JSONファイルからスケジュール設定を読み込み、全ての時刻の形式を検証する
+
+        :return: スケジュール設定
+        :raises ValueError: 時刻がHH:MM形式の有効な時刻でない場合
+        """
+        with open(self.config_file, 'r') as f:
+            schedule_config = json.load(f)['schedule']
+        for item in schedule_config:
+            time = item['time']
+            if not isinstance(time, str) or not re.fullmatch(r'\d{2}:\d{2}', time):
+                raise ValueError(f"時刻はHH:MM形式で指定してください: {time!r}")
+            datetime.strptime(time, "%H:%M")
+        return schedule_config
 
     def _load_config(self) -> None:
         """
         JSONファイルからスケジュール設定を読み込む
         """
         try:
-            with open(self.config_file, 'r') as f:
-                config = json.load(f)
-                self.schedule_config = config['schedule']
+            self.schedule_config = self._read_config()
             logger.info(f"スケジュール設定を正常に読み込みました: {self.schedule_config}")
         except FileNotFoundError:
             logger.error(f"設定ファイル '{self.config_file}' が見つかりません。")
@@ -36,14 +62,21 @@ class Scheduler:
         except json.JSONDecodeError:
             logger.error(f"設定ファイル '{self.config_file}' の解析に失敗しました。正しいJSON形式であることを確認してください。")
             raise
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"設定ファイル '{self.config_file}' の内容が正しくありません: {e}")
+            raise
 
-    def _job(self) -> None:
+    def _job(self, slot: str = None) -> None:
         """
         スケジュールされたジョブを実行する
+
+        :param slot: スケジュール時刻（HH:MM形式、実行台帳に記録する）
         """
         logger.info("スケジュールされたジョブを開始します。")
         try:
+            started_at = time.time()
             results = self.multi_user_poster.post_for_all_users()
+            self.run_ledger.record_run(slot, started_at, time.time(), results)
             for result in results:
                 if result['status'] == 'success':
                     logger.info(f"ユーザー '{result['username']}' の投稿が成功しました。スレッドID: {result['thread_id']}")
@@ -52,18 +85,96 @@ class Scheduler:
         except Exception as e:
             logger.error(f"ジョブの実行中にエラーが発生しました: {str(e)}")
 
+    def _precheck_tokens(self) -> None:
+        """
+        スケジュール前にトークンを検証・更新しておく（結果はTokenManagerにキャッシュされる）
+        """
+        logger.info("スケジュール前のトークン事前検証を開始します。")
+        try:
+            self.token_manager.get_valid_users()
+        except Exception as e:
+            logger.error(f"トークンの事前検証中にエラーが発生しました: {str(e)}")
+
+    @staticmethod
+    def _precheck_time(time: str) -> str:
+        """
+        スケジュール時刻から事前検証を行う時刻（HH:MM形式）を求める
+        """
+        precheck = datetime.strptime(time, "%H:%M") - timedelta(minutes=TOKEN_PRECHECK_MINUTES)
+        return precheck.strftime("%H:%M")
+
+    def _schedule_slot(self, time: str) -> None:
+        """
+        投稿ジョブとトークン事前検証ジョブを登録する（時刻でタグ付けして削除できるようにする）
+        """
+        schedule.every().day.at(time).do(self._job, time).tag(time)
+        schedule.every().day.at(self._precheck_time(time)).do(self._precheck_tokens).tag(time)
+
+    def _reload_schedule(self) -> None:
+        """
+        スケジュール設定を再読み込みし、追加・削除された時刻のジョブだけを登録・解除する
+
+        全ての時刻を検証してから登録中のジョブを変更するため、不正な設定では現在のスケジュールがそのまま残る。
+        """
+        old_times = {item['time'] for item in self.schedule_config}
+        try:
+            schedule_config = self._read_config()
+        except Exception as e:
+            logger.error(f"スケジュール設定の再読み込みに失敗しました。現在のスケジュールを維持します: {type(e).__name__}: {e}")
+            return
+        self.schedule_config = schedule_config
+        logger.info(f"スケジュール設定を再読み込みしました: {self.schedule_config}")
+        new_times = {item['time'] for item in self.schedule_config}
+        for time in sorted(old_times - new_times):
+            schedule.clear(time)
+            logger.info(f"スケジュールを削除しました: {time}")
+        for time in sorted(new_times - old_times):
+            self._schedule_slot(time)
+            logger.info(f"スケジュール設定: 毎日 {time} に実行")
+
+    def _check_reload(self) -> None:
+        """
+        設定ファイルの変更を確認し、変更された部分だけを反映する
+
+        ジョブはこのループ内で同期的に実行されるため、反映は実行中のジョブの合間に行われる。
+        """
+        changed = self.config_watcher.poll()
+        if not changed:
+            return
+        if os.path.abspath(self.config_file) in changed:
+            self._reload_schedule()
+        if os.path.abspath(self.user_manager.users_file) in changed:
+            changes = self.user_manager.reload()
+            self.multi_user_poster.invalidate_users(changes['removed'] + changes['updated'])
+        if os.path.abspath(config.__file__) in changed:
+            self._apply_settings(reload_settings())
+
+    def _apply_settings(self, changed: List[str]) -> None:
+        """
+        再読み込みした設定を、生成時に設定を取り込んでいるオブジェクトに反映する
+
+        :param changed: 値が変わった設定名の一覧
+        """
+        if not changed:
+            return
+        # メディアバックエンドや返信のアップロード並列数はPostManager・ReplyPosterの生成時に決まるため作り直す
+        self.multi_user_poster.invalidate_all()
+        if {'POST_COOLDOWN_HOURS', 'POST_SELECTION_WEIGHTS'} & set(changed):
+            self.image_pair_manager.reload_settings()
+
     def run(self) -> None:
         """
         スケジューラーを設定し、実行する
         """
         for schedule_item in self.schedule_config:
-            schedule.every().day.at(schedule_item['time']).do(self._job)
+            self._schedule_slot(schedule_item['time'])
             logger.info(f"スケジュール設定: 毎日 {schedule_item['time']} に実行")
 
         logger.info("スケジューラーを開始します。Ctrl+Cで停止できます。")
         try:
             while True:
                 schedule.run_pending()
+                self._check_reload()
                 time.sleep(1)
         except KeyboardInterrupt:
             logger.info("スケジューラーを停止します。")
@@ -76,7 +187,7 @@ class Scheduler:
         """
         self.schedule_config.append({"time": time})
         self._save_config()
-        schedule.every().day.at(time).do(self._job)
+        self._schedule_slot(time)
         logger.info(f"新しいスケジュールを追加しました: 毎日 {time} に実行")
 
     def remove_schedule(self, time: str) -> None:
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+from base_post import ThreadsClient
+from user_manager import UserManager
+from config import TOKEN_CACHE_FILE, TOKEN_REFRESH_MARGIN_DAYS, TOKEN_VALIDATION_TTL_MINUTES, TOKEN_CHECK_MAX_WORKERS
+
+# ロギングの設定
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Graph APIの「アクセストークンが無効」エラーコード
+INVALID_TOKEN_ERROR_CODE = 190
+
+class TokenManager:
+    """
+    全アカウントのアクセストークンを並列に検証・更新するクラス
+
+    トークンの有効期限と検証結果はキャッシュファイルに保存し、
+    更新されたトークンはUserManager経由でユーザーファイルに書き戻します。
+    """
+
+    def __init__(self, user_manager: UserManager, cache_file: str = TOKEN_CACHE_FILE):
+        """
+        TokenManagerクラスのコンストラクタ
+
+        :param user_manager: ユーザー情報を管理するUserManager
+        :param cache_file: トークンの有効期限と検証結果を保存するJSONファイルのパス
+        """
+        self.user_manager = user_manager
+        self.cache_file = cache_file
+        self.cache: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._load_cache()
+
+    def _load_cache(self) -> None:
+        """
+        キャッシュファイルを読み込む
+        """
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.cache = json.load(f)
+            logger.info(f"トークンキャッシュを読み込みました: {len(self.cache)}アカウント")
+        except json.JSONDecodeError:
+            logger.error(f"トークンキャッシュ '{self.cache_file}' の解析に失敗しました。空のキャッシュで開始します。")
+            self.cache = {}
+
+    def _save_cache(self) -> None:
+        """
+        キャッシュファイルを保存する
+        """
+        tmp_file = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+        except IOError:
+            logger.error(f"トークンキャッシュの保存中にエラーが発生しました。")
+            raise
+
+    @staticmethod
+    def _fingerprint(access_token: str) -> str:
+        """
+        キャッシュとトークンを対応付けるためのハッシュ（トークン自体はキャッシュに保存しない）
+        """
+        return hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _is_invalid_token_error(error: Exception) -> bool:
+        """
+        例外がトークン失効によるものかを判定する
+        """
+        response = getattr(error, 'response', None)
+        if response is None or response.status_code not in (400, 401):
+            return False
+        try:
+            error_body = response.json().get('error', {})
+        except ValueError:
+            return response.status_code == 401
+        return error_body.get('code') == INVALID_TOKEN_ERROR_CODE or response.status_code == 401
+
+    def _get_entry(self, user: Dict[str, str]) -> Dict:
+        """
+        ユーザーの現在のトークンに対応するキャッシュエントリを返す
+        """
+        with self._lock:
+            entry = self.cache.get(user['username'], {})
+        if entry.get('fingerprint') != self._fingerprint(user['access_token']):
+            return {}
+        return dict(entry)
+
+    def _set_entry(self, username: str, entry: Dict) -> None:
+        with self._lock:
+            self.cache[username] = entry
+            self._save_cache()
+
+    def check_user(self, user: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """
+        単一ユーザーのトークンを検証し、必要に応じて更新する
+
+        :param user: ユーザー情報の辞書
+        :return: 有効なトークンを持つユーザー情報（更新後のトークンを含む）。トークンが失効している場合はNone
+        """
+        username = user['username']
+        now = time.time()
+        entry = self._get_entry(user)
+
+        if entry.get('valid') and now - entry.get('validated_at', 0) < TOKEN_VALIDATION_TTL_MINUTES * 60 \
+                and not self._needs_refresh(entry, now):
+            logger.info(f"ユーザー '{username}' のトークンは検証済みです（キャッシュ）。")
+            return user
+        if entry.get('valid') is False and now - entry.get('validated_at', 0) < TOKEN_VALIDATION_TTL_MINUTES * 60:
+            logger.error(f"ユーザー '{username}' のトークンは失効しています（キャッシュ）。このアカウントを除外します。")
+            return None
+
+        client = ThreadsClient(user['access_token'], username)
+
+        if self._needs_refresh(entry, now):
+            try:
+                response = client.refresh_access_token()
+                user = dict(user, access_token=response['access_token'])
+                self.user_manager.update_access_token(username, user['access_token'])
+                self._set_entry(username, {
+                    'fingerprint': self._fingerprint(user['access_token']),
+                    'expires_at': now + int(response.get('expires_in', 0)) if response.get('expires_in') else None,
+                    'validated_at': now,
+                    'valid': True
+                })
+                logger.info(f"ユーザー '{username}' のトークンを更新しました。")
+                return user
+            except requests.exceptions.RequestException as e:
+                # 発行から24時間以内のトークンは更新できないため、更新失敗だけでは失効とみなさない
+                logger.warning(f"ユーザー '{username}' のトークン更新に失敗しました。検証を続行します: {e}")
+                entry['refresh_failed_at'] = now
+
+        try:
+            client.get_profile()
+        except requests.exceptions.RequestException as e:
+            if self._is_invalid_token_error(e):
+                logger.error(f"ユーザー '{username}' のトークンは失効しています。このアカウントを除外します。")
+                entry.update({'fingerprint': self._fingerprint(user['access_token']), 'validated_at': now, 'valid': False})
+                self._set_entry(username, entry)
+                return None
+            # ネットワーク障害などトークン以外の原因では除外しない
+            logger.warning(f"ユーザー '{username}' のトークン検証中にエラーが発生しました。アカウントは除外しません: {e}")
+            return user
+
+        entry.update({'fingerprint': self._fingerprint(user['access_token']), 'validated_at': now, 'valid': True})
+        self._set_entry(username, entry)
+        logger.info(f"ユーザー '{username}' のトークンは有効です。")
+        return user
+
+    @staticmethod
+    def _needs_refresh(entry: Dict, now: float) -> bool:
+        """
+        有効期限が不明、または更新マージン以内の場合に更新が必要と判定する
+
+        更新に失敗した場合は24時間（トークンが更新可能になるまでの期間）は再試行しない。
+        """
+        if now - entry.get('refresh_failed_at', 0) < 86400:
+            return False
+        expires_at = entry.get('expires_at')
+        return expires_at is None or expires_at - now < TOKEN_REFRESH_MARGIN_DAYS * 86400
+
+    def get_valid_users(self, users: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
+        """
+        全ユーザーのトークンを並列に検証し、有効なユーザーのみを返す
+
+        :param users: 検証するユーザー一覧（省略時はUserManagerの全ユーザー）
+        :return: 有効なトークンを持つユーザー一覧（元の順序を維持）
+        """
+        users = users if users is not None else self.user_manager.get_users()
+        if not users:
+            return []
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=min(TOKEN_CHECK_MAX_WORKERS, len(users))) as executor:
+            checked = list(executor.map(self.check_user, users))
+        valid_users = [user for user in checked if user is not None]
+        logger.info(f"トークン検証完了: 有効 {len(valid_users)}/{len(users)}アカウント（{time.time() - start_time:.1f}秒）")
+        return valid_users
+
+# 使用例
+if __name__ == "__main__":
+    from config import REPLIES_PARENT_FOLDER
+    user_manager = UserManager("users.json", REPLIES_PARENT_FOLDER)
+    token_manager = TokenManager(user_manager)
+    valid_users = token_manager.get_valid_users()
+    print([user['username'] for user in valid_users])
@@ -2,6 +2,10 @@ import json
 import logging
 from typing import List, Dict
 import os
+import threading
+
+# 読み込み時に算出する実行時のみの項目（ユーザーファイルには保存しない）
+DERIVED_FIELDS = ('has_reply_folder',)
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,6 +22,7 @@ class UserManager:
         self.users_file = users_file
         self.replies_parent_folder = replies_parent_folder
         self.users: List[Dict[str, str]] = []
+        self._lock = threading.Lock()
         self._load_users()
 
     def _load_users(self) -> None:
@@ -26,8 +31,8 @@ class UserManager:
         """
         try:
             with open(self.users_file, 'r', encoding='utf-8') as f:
-                self.users = json.load(f)
-            logger.info(f"{len(self.users)}人のユーザー情報を正常に読み込みました。")
+                users = json.load(f)
+            logger.info(f"{len(users)}人のユーザー情報を正常に読み込みました。")
             
             # リプライの親フォルダが存在しない場合は作成
             if not os.path.exists(self.replies_parent_folder):
@@ -35,7 +40,7 @@ class UserManager:
                 logger.info(f"リプライの親フォルダを作成しました: {self.replies_parent_folder}")
 
             # 各ユーザーのリプライフォルダの存在を確認
-            for user in self.users:
+            for user in users:
                 reply_folder = os.path.join(self.replies_parent_folder, user['username'])
                 if os.path.exists(reply_folder):
                     user['has_reply_folder'] = True
@@ -44,6 +49,9 @@ class UserManager:
                     user['has_reply_folder'] = False
                     logger.info(f"ユーザー '{user['username']}' のリプライフォルダが見つかりません。リプライは行いません。")
 
+            # 実行中のジョブが参照しているリストは変更せず、新しいリストに置き換える
+            self.users = users
+
         except FileNotFoundError:
             logger.error(f"ユーザーファイル '{self.users_file}' が見つかりません。")
             raise
@@ -51,6 +59,30 @@ class UserManager:
             logger.error(f"ユーザーファイル '{self.users_file}' の解析に失敗しました。正しいJSON形式であることを確認してください。")
             raise
 
+    def reload(self) -> Dict[str, List[str]]:
+        """
+        ユーザーファイルを再読み込みし、変更のあったユーザーを返す
+
+        読み込みに失敗した場合は現在のユーザー情報を維持します。
+
+        :return: 追加・削除・更新されたユーザー名の一覧を含む辞書
+        """
+        old_users = {user['username']: user for user in self.users}
+        try:
+            self._load_users()
+        except Exception as e:
+            # 必須項目のないエントリ（KeyError）なども含め、実行中のスケジューラーは止めない
+            logger.error(f"ユーザーファイルの再読み込みに失敗しました。現在のユーザー情報を維持します: {type(e).__name__}: {e}")
+            return {"added": [], "removed": [], "updated": []}
+        new_users = {user['username']: user for user in self.users}
+        changes = {
+            "added": [name for name in new_users if name not in old_users],
+            "removed": [name for name in old_users if name not in new_users],
+            "updated": [name for name in new_users if name in old_users and new_users[name] != old_users[name]]
+        }
+        logger.info(f"ユーザー情報を再読み込みしました: 追加 {changes['added']}, 削除 {changes['removed']}, 更新 {changes['updated']}")
+        return changes
+
     def get_users(self) -> List[Dict[str, str]]:
         """
         ユーザーリストを返す
@@ -81,13 +113,28 @@ class UserManager:
         self._save_users()
         logger.info(f"ユーザー '{username}' を削除しました。")
 
+    def update_access_token(self, username: str, access_token: str) -> None:
+        """
+        指定されたユーザーのアクセストークンを更新して保存する
+
+        :param username: ユーザー名
+        :param access_token: 新しいアクセストークン
+        """
+        with self._lock:
+            for user in self.users:
+                if user["username"] == username:
+                    user["access_token"] = access_token
+            self._save_users()
+        logger.info(f"ユーザー '{username}' のアクセストークンを更新しました。")
+
     def _save_users(self) -> None:
         """
         ユーザー情報をJSONファイルに保存する
         """
         try:
+            users = [{key: value for key, value in user.items() if key not in DERIVED_FIELDS} for user in self.users]
             with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users, f, indent=2, ensure_ascii=False)
+                json.dump(users, f, indent=2, ensure_ascii=False)
             logger.info(f"ユーザー情報を '{self.users_file}' に保存しました。")
         except IOError:
             logger.error(f"ユーザー情報の保存中にエラーが発生しました。")